@@ -0,0 +1,620 @@
+# Copyright (c) 2010 Mark Sandstrom
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import os
+os.environ['DJANGO_SETTINGS_MODULE'] = 'settings'
+
+import gc
+import json
+import re
+import shutil
+import sre_compile
+import sys
+import tempfile
+import timeit
+from functools import partial
+from optparse import OptionParser
+
+from django.conf.urls import include, patterns as django_patterns, url as django_url
+from django.core.handlers.wsgi import WSGIRequest
+from django.core.urlresolvers import RegexURLResolver, Resolver404, ResolverMatch, reverse, set_urlconf
+from django.http import HttpRequest, HttpResponse, HttpResponseRedirect
+from django.test.utils import override_settings
+from django.utils.translation import get_language
+
+from reroute import instrumentation, reroute_patterns, routetable, url
+from reroute.base import RerouteRegexURLPattern
+from reroute.caching import ResponseCache
+from reroute.limits import ConcurrencyLimit
+from reroute.decorators import redirect, render
+from reroute.verbs import VerbRegexURLPattern, request_method, verb_url
+from reroute.utils import rollup
+from reroute.warmup import warm_resolver
+
+RESPONSE = HttpResponse('OK')
+
+def view(request, *args, **kwargs):
+    return RESPONSE
+
+def passthrough_wrapper(view, request, *args, **kwargs):
+    return view(request, *args, **kwargs)
+
+def best_of(function, number, repeat=5):
+    '''Returns the fastest per-call time of function in microseconds.'''
+    
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number * 1e6
+
+# Every reported measurement, written out by --json
+RESULTS = []
+
+UNITS = {'us': '%.2fus', 'bytes': '%.0fB'}
+
+def report(name, unit='us', params=None, **values):
+    RESULTS.append({'name': name, 'unit': unit, 'params': params or {}, 'values': values})
+    print '%-55s %s' % (name, '  '.join(('%s: ' + UNITS[unit]) % item for item in sorted(values.items(), reverse=True)))
+
+def allocated(build):
+    '''Returns build() and the approximate number of bytes of the objects it created (and still
+    references): every new object tracked by the garbage collector, plus the strings, numbers
+    and other untracked objects they refer to.'''
+    
+    gc.collect()
+    existing = set(id(obj) for obj in gc.get_objects())
+    result = build()
+    gc.collect()
+    
+    seen = set([id(existing)])
+    size = 0
+    for obj in gc.get_objects():
+        if id(obj) in existing or id(obj) in seen:
+            continue
+        for referenced in [obj] + gc.get_referents(obj):
+            if id(referenced) in seen or id(referenced) in existing:
+                continue
+            if referenced is not obj and gc.is_tracked(referenced):
+                continue
+            seen.add(id(referenced))
+            size += sys.getsizeof(referenced)
+    return result, size
+
+# Benchmarks
+
+def bench_wrapper_dispatch(depth, number=20000):
+    pattern, = reroute_patterns([passthrough_wrapper] * depth, '',
+        url('^test$', view)
+    )
+    request = HttpRequest()
+    
+    def per_request_rollup():
+        rollup(pattern.callback, pattern.wrappers)(request)
+        
+    def precomposed():
+        pattern.reroute_callback(request)
+    
+    report('wrapper dispatch (%d wrappers)' % depth,
+        before=best_of(per_request_rollup, number),
+        after=best_of(precomposed, number)
+    )
+
+def resolve(resolver, path):
+    try:
+        return resolver.resolve(path)
+    except Resolver404:
+        return None
+
+def bench_group_resolve(size, number=1000, **options):
+    def build(**options):
+        return RegexURLResolver(r'^/', reroute_patterns([], '', *[
+            url(r'^resource%d/(?P<id>\d+)/$' % i, view) for i in range(size)
+        ], **options))
+    
+    plain = build()
+    group = build(**options)
+    
+    for name, path in (('first', '/resource0/1/'), ('last', '/resource%d/1/' % (size - 1)), ('miss', '/missing/')):
+        report('resolve %s (%d patterns, %s)' % (name, size, ', '.join('%s=%s' % item for item in options.items())),
+            before=best_of(lambda: resolve(plain, path), number),
+            after=best_of(lambda: resolve(group, path), number)
+        )
+
+def bench_verb_resolve(resources, verbs=('GET', 'POST', 'PUT', 'PATCH', 'DELETE'), number=1000):
+    regexes = [r'^resource%d/(?P<id>\d+)/$' % i for i in range(resources)]
+    
+    # Before verb groups were collapsed, every verb_url pattern stayed in the urlconf and cost a
+    # regex search, just like these plain patterns
+    uncollapsed = RegexURLResolver(r'^/', django_patterns('', *[
+        (regex, view) for regex in regexes for verb in verbs
+    ]))
+    collapsed = RegexURLResolver(r'^/', reroute_patterns([], '', *[
+        verb_url(verb, regex, view) for regex in regexes for verb in verbs
+    ]))
+    
+    for name, path in (('last', '/resource%d/1/' % (resources - 1)), ('miss', '/missing/')):
+        report('resolve %s (%d resources, %d verbs each)' % (name, resources, len(verbs)),
+            before=best_of(lambda: resolve(uncollapsed, path), number),
+            after=best_of(lambda: resolve(collapsed, path), number)
+        )
+
+class UploadStream(object):
+    '''A multipart body with a _method field followed by a file of the given size, generated as
+    it's read.'''
+    
+    boundary = 'BoUnDaRy'
+    
+    def __init__(self, size):
+        self.head = (
+            '--%(boundary)s\r\nContent-Disposition: form-data; name="_method"\r\n\r\nput\r\n'
+            '--%(boundary)s\r\nContent-Disposition: form-data; name="upload"; filename="upload.bin"\r\n'
+            'Content-Type: application/octet-stream\r\n\r\n' % {'boundary': self.boundary}
+        )
+        self.tail = '\r\n--%s--\r\n' % self.boundary
+        self.length = len(self.head) + size + len(self.tail)
+        self.position = 0
+        
+    def read(self, size=None):
+        if size is None:
+            size = self.length - self.position
+        start = self.position
+        end = self.position = min(self.length, start + size)
+        upload_start = len(self.head)
+        upload_end = self.length - len(self.tail)
+        
+        data = self.head[start:end]
+        if end > upload_start and start < upload_end:
+            data += '\0' * (min(end, upload_end) - max(start, upload_start))
+        if end > upload_end:
+            data += self.tail[max(start - upload_end, 0):end - upload_end]
+        return data
+
+def upload_request(size):
+    stream = UploadStream(size)
+    return WSGIRequest({
+        'REQUEST_METHOD': 'POST',
+        'PATH_INFO': '/',
+        'CONTENT_TYPE': 'multipart/form-data; boundary=%s' % stream.boundary,
+        'CONTENT_LENGTH': str(stream.length),
+        'wsgi.input': stream,
+    })
+
+def bench_method_override(size=100 * 1024 * 1024):
+    def override(mechanism):
+        with override_settings(REROUTE_METHOD_OVERRIDE=(mechanism,)):
+            # Setting up the request isn't timed
+            requests = [upload_request(size)]
+            return best_of(lambda: request_method(requests.pop()), 1, repeat=1)
+    
+    report('_method override (%d MB upload)' % (size / 1024 / 1024),
+        before=override('post'),
+        after=override('body')
+    )
+
+class URLConf(object):
+    def __init__(self, urlpatterns):
+        self.urlpatterns = urlpatterns
+
+def bench_redirect(size, number=5000):
+    set_urlconf(URLConf(reroute_patterns([], '', *[
+        url(r'^resource%d/(?P<id>\d+)/$' % i, view, name='resource%d' % i) for i in range(size)
+    ])))
+    
+    viewname = 'resource%d' % (size - 1)
+    kwargs = {'id': 42}
+    redirecting = redirect(viewname)(lambda request: kwargs)
+    request = HttpRequest()
+    
+    try:
+        report('redirect (%d patterns)' % size,
+            before=best_of(lambda: HttpResponseRedirect(reverse(viewname, kwargs=kwargs)), number),
+            after=best_of(lambda: redirecting(request), number)
+        )
+    finally:
+        set_urlconf(None)
+
+def bench_adaptive(size, number=1000):
+    def build(**options):
+        return RegexURLResolver(r'^/', reroute_patterns([], '', *[
+            url(r'^resource%d/(?P<id>\d+)/$' % i, view) for i in range(size)
+        ], **options))
+    
+    plain = build()
+    adaptive = build(matcher='adaptive')
+    
+    # The busiest route is declared last
+    hot = '/resource%d/1/' % (size - 1)
+    group, = adaptive.url_patterns
+    for i in range(group.matcher.REORDER_EVERY):
+        resolve(adaptive, hot)
+    
+    report('resolve hot route (%d patterns, matcher=adaptive)' % size,
+        before=best_of(lambda: resolve(plain, hot), number),
+        after=best_of(lambda: resolve(adaptive, hot), number)
+    )
+
+def bench_instrumentation(depth=5, number=20000):
+    resolver = RegexURLResolver(r'^/', URLConf(reroute_patterns([passthrough_wrapper] * depth, '',
+        url('^test$', view, name='test')
+    )))
+    request = HttpRequest()
+    request.method = 'GET'
+    
+    def dispatch():
+        callback, args, kwargs = resolver.resolve('/test')
+        return callback(request, *args, **kwargs)
+    
+    off = best_of(dispatch, number)
+    aggregator = instrumentation.Aggregator()
+    instrumentation.register(aggregator)
+    try:
+        on = best_of(dispatch, number)
+    finally:
+        instrumentation.unregister(aggregator)
+    
+    report('dispatch with instrumentation (%d wrappers)' % depth, off=off, on=on)
+
+class ClosurePattern(RerouteRegexURLPattern):
+    '''Returns a new closure from every resolve, as reroute used to.'''
+    
+    def resolver_match(self, args, kwargs):
+        kwargs.update(self.default_args)
+        callback = lambda request, *args, **kwargs: self.reroute_callback(request, *args, **kwargs)
+        if hasattr(self.callback, 'csrf_exempt'):
+            callback.csrf_exempt = self.callback.csrf_exempt
+        return ResolverMatch(callback, args, kwargs, self.name)
+
+def bench_resolver_match(number=50000, kept=1000):
+    def build(cls):
+        pattern, = reroute_patterns([], '',
+            url(r'^resource/(?P<id>\d+)/$', view)
+        )
+        pattern.__class__ = cls
+        return pattern
+    
+    closure = build(ClosurePattern)
+    reused = build(RerouteRegexURLPattern)
+    
+    report('resolve one pattern',
+        before=best_of(lambda: closure.resolve('resource/1/'), number),
+        after=best_of(lambda: reused.resolve('resource/1/'), number)
+    )
+    
+    # Python 2 has no tracemalloc, so count what the kept matches hold on to instead
+    def per_resolve(pattern):
+        pattern.resolve('resource/1/')
+        matches, size = allocated(lambda: [pattern.resolve('resource/1/') for i in range(kept)])
+        return float(size) / kept
+    
+    report('memory per resolve', unit='bytes',
+        before=per_resolve(closure),
+        after=per_resolve(reused)
+    )
+
+def bench_response_cache(items=100, number=5000):
+    def listing(request, id):
+        return HttpResponse(json.dumps([{'id': id, 'index': i} for i in range(items)]))
+    
+    def build(wrappers):
+        return RegexURLResolver(r'^/', URLConf(reroute_patterns(wrappers, '',
+            url(r'^resource/(?P<id>\d+)/$', listing)
+        )))
+    
+    plain = build([])
+    cached = build([ResponseCache()])
+    request = HttpRequest()
+    request.method = 'GET'
+    request.path = request.path_info = '/resource/1/'
+    
+    def dispatch(resolver):
+        callback, args, kwargs = resolver.resolve(request.path_info)
+        return callback(request, *args, **kwargs)
+    
+    report('cached response (%d items)' % items,
+        before=best_of(lambda: dispatch(plain), number),
+        after=best_of(lambda: dispatch(cached), number)
+    )
+
+def bench_concurrency_limit(number=20000):
+    def build(wrappers):
+        return RegexURLResolver(r'^/', URLConf(reroute_patterns(wrappers, '',
+            url('^test$', view)
+        )))
+    
+    request = HttpRequest()
+    request.method = 'GET'
+    
+    def dispatch(resolver):
+        callback, args, kwargs = resolver.resolve('/test')
+        return callback(request, *args, **kwargs)
+    
+    plain = build([])
+    limited = build([ConcurrencyLimit(10)])
+    report('dispatch with a concurrency limit (uncontended)',
+        before=best_of(lambda: dispatch(plain), number),
+        after=best_of(lambda: dispatch(limited), number)
+    )
+
+def bench_head(items=100, number=2000):
+    directory = tempfile.mkdtemp()
+    with open(os.path.join(directory, 'page.html'), 'w') as template:
+        template.write('{% for item in items %}<li>{{ item }}</li>{% endfor %}')
+    
+    @render('page.html')
+    def page(request):
+        return {'items': range(items)}
+    
+    def build(*urls):
+        return RegexURLResolver(r'^/', URLConf(reroute_patterns([], '', *urls)))
+    
+    # HEAD explicitly routed to the GET view renders the whole page
+    explicit = build(verb_url('GET', '^page$', page), verb_url('HEAD', '^page$', page))
+    automatic = build(verb_url('GET', '^page$', page))
+    request = HttpRequest()
+    request.method = 'HEAD'
+    
+    def dispatch(resolver):
+        callback, args, kwargs = resolver.resolve('/page')
+        return callback(request, *args, **kwargs)
+    
+    try:
+        with override_settings(TEMPLATE_DIRS=(directory,)):
+            report('HEAD of a rendered page (%d items)' % items,
+                before=best_of(lambda: dispatch(explicit), number),
+                after=best_of(lambda: dispatch(automatic), number)
+            )
+    finally:
+        shutil.rmtree(directory)
+
+class DictLayout(object):
+    '''Holds a pattern's attributes the way they were stored before patterns had slots (see
+    bench_pattern_memory).'''
+
+def dict_layout(pattern, wrappers):
+    '''Returns a DictLayout with the attributes pattern had before: all in the instance dict, a
+    regex source and compiled regex of its own (re's cache only holds 100), a new dict for empty
+    default arguments, the wrapper list of its reroute_patterns call and one dict per verb record.'''
+    
+    layout = DictLayout()
+    attributes = layout.__dict__
+    source = pattern._regex[:1] + pattern._regex[1:]
+    attributes.update(_regex=source, _regex_dict={get_language(): sre_compile.compile(source, re.UNICODE)},
+        _callback=pattern._callback, default_args=dict(pattern.default_args), name=pattern.name)
+    if not isinstance(pattern, RerouteRegexURLPattern):
+        return layout
+    
+    attributes.update(_wrappers=wrappers, _configured=True, _composed_callbacks={pattern._callback: pattern._composed[1]})
+    if isinstance(pattern, VerbRegexURLPattern):
+        records = dict((method, {'callback': record.callback, 'default_args': dict(record.default_args)})
+            for method, record in pattern.method_callbacks.iteritems())
+        table = dict((method, (composed, records[method]['default_args']))
+            for method, (composed, default_args) in pattern.method_table.iteritems())
+        attributes.update(method=pattern.method, method_callbacks=records, collapsed=False, _method_table=table)
+    return layout
+
+def bench_pattern_memory(tenants=200, resources=('items', 'orders', 'users')):
+    '''Compares the memory per route of a multi-tenant urlconf (every tenant includes the same
+    generated routes) with the same routes in the layout patterns had before (see dict_layout).'''
+    
+    def tenant_patterns():
+        urls = []
+        for resource in resources:
+            collection = r'^%s/$' % resource
+            item = r'^%s/(?P<id>\d+)/$' % resource
+            urls += [verb_url(verb, collection, view) for verb in ('GET', 'POST')]
+            urls += [verb_url(verb, item, view) for verb in ('GET', 'PUT', 'DELETE')]
+        urls.append(url(r'^%s/$' % 'about', view))
+        return reroute_patterns([passthrough_wrapper], '', *urls)
+    
+    def build(tenants):
+        resolver = RegexURLResolver(r'^/', URLConf(reroute_patterns([], '',
+            *[url('^tenant%d/' % tenant, include(tenant_patterns())) for tenant in range(tenants)]
+        )))
+        warm_resolver(resolver, [])
+        return resolver
+    
+    def legacy(resolver):
+        for tenant in resolver.url_patterns:
+            wrappers = [passthrough_wrapper]
+            tenant.url_patterns[:] = [dict_layout(pattern, wrappers) for pattern in tenant.url_patterns]
+        return resolver
+    
+    routes = tenants * (len(resources) * 5 + 1)
+    build(1)
+    resolver, compact = allocated(lambda: build(tenants))
+    del resolver
+    resolver, before = allocated(lambda: legacy(build(tenants)))
+    
+    report('memory per route (%d routes)' % routes, unit='bytes', params=dict(routes=routes),
+        before=float(before) / routes,
+        after=float(compact) / routes
+    )
+
+# Synthetic urlconfs
+
+VERBS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE')
+
+def decorate(depth):
+    '''Returns a decorator applying depth passthrough wrappers to a view, which is the Django
+    equivalent of reroute_patterns wrappers.'''
+    
+    def decorator(function):
+        for i in range(depth):
+            function = partial(passthrough_wrapper, function)
+        return function
+    return decorator
+
+def synthetic_urlconf(flavor, size, depth=0, verbs=1, nesting=0, **options):
+    '''Returns a URLConf with size patterns, built with reroute (flavor='reroute') or plain Django
+    patterns (flavor='django'). Every resource has verbs patterns (verb_url patterns with reroute;
+    Django can't dispatch on verbs, so it gets the same number of plain patterns), each view is
+    wrapped depth times, and the patterns are nested nesting levels deep in includes. options
+    are passed to reroute_patterns.'''
+    
+    regexes = [r'^resource%d/(?P<id>\d+)/$' % i for i in range(max(size // verbs, 1))]
+    
+    if flavor == 'reroute':
+        if verbs > 1:
+            urls = [verb_url(verb, regex, view) for regex in regexes for verb in VERBS[:verbs]]
+        else:
+            urls = [url(regex, view) for regex in regexes]
+        urlpatterns = reroute_patterns([passthrough_wrapper] * depth, '', *urls, **options)
+        nest = lambda level, urlpatterns: reroute_patterns([], '', url('^level%d/' % level, include(urlpatterns)))
+    else:
+        wrapped = decorate(depth)(view)
+        urlpatterns = django_patterns('', *[django_url(regex, wrapped) for regex in regexes for verb in VERBS[:verbs]])
+        nest = lambda level, urlpatterns: django_patterns('', django_url('^level%d/' % level, include(urlpatterns)))
+    
+    for level in reversed(range(nesting)):
+        urlpatterns = nest(level, urlpatterns)
+    
+    prefix = '/' + ''.join('level%d/' % level for level in range(nesting))
+    paths = {
+        'hit': prefix + 'resource0/1/',
+        'late': prefix + 'resource%d/1/' % (len(regexes) - 1),
+        'miss': prefix + 'missing/',
+    }
+    return URLConf(urlpatterns), paths
+
+def bench_urlconf(size, depth=0, verbs=1, nesting=0, **options):
+    params = dict(size=size, depth=depth, verbs=verbs, nesting=nesting, **options)
+    label = ', '.join('%s=%s' % item for item in sorted(params.items()))
+    number = max(20000 // size, 5)
+    
+    def build(flavor, size):
+        urlconf, paths = synthetic_urlconf(flavor, size, depth, verbs, nesting, **options)
+        resolver = RegexURLResolver(r'^/', urlconf)
+        # Compiles every regex
+        resolve(resolver, paths['miss'])
+        return resolver, paths
+    
+    urlconfs = {}
+    memory = {}
+    for flavor in ('django', 'reroute'):
+        # The first build also allocates the caches and lazily imported modules used by every build
+        build(flavor, 1)
+        (urlconfs[flavor], paths), size_in_bytes = allocated(lambda: build(flavor, size))
+        memory[flavor] = float(size_in_bytes) / size
+        
+    for name in ('hit', 'late', 'miss'):
+        path = paths[name]
+        report('resolve %s (%s)' % (name, label), params=dict(params, path=name),
+            before=best_of(lambda: resolve(urlconfs['django'], path), number),
+            after=best_of(lambda: resolve(urlconfs['reroute'], path), number)
+        )
+    
+    request = HttpRequest()
+    request.method = 'GET'
+    
+    def dispatch(resolver):
+        callback, args, kwargs = resolver.resolve(paths['late'])
+        return callback(request, *args, **kwargs)
+        
+    report('dispatch late (%s)' % label, params=params,
+        before=best_of(lambda: dispatch(urlconfs['django']), number),
+        after=best_of(lambda: dispatch(urlconfs['reroute']), number)
+    )
+    report('memory per pattern (%s)' % label, unit='bytes', params=params,
+        before=memory['django'],
+        after=memory['reroute']
+    )
+
+URLCONF_MODULE = """
+from reroute import reroute_patterns, url
+from reroute.verbs import verb_url
+from benchmarks import passthrough_wrapper
+
+urlpatterns = reroute_patterns([passthrough_wrapper], '', *[
+%s
+])
+"""
+
+def bench_routetable(size, verbs=5, number=5):
+    directory = tempfile.mkdtemp()
+    module = 'routetable_urls_%d' % size
+    lines = ["    verb_url('%s', r'^resource%d/(?P<id>\\d+)/$', 'benchmarks.view')," % (verb, i)
+        for i in range(size // verbs) for verb in VERBS[:verbs]]
+    with open(os.path.join(directory, module + '.py'), 'w') as source:
+        source.write(URLCONF_MODULE % '\n'.join(lines))
+    path = os.path.join(directory, 'routes.table')
+    sys.path.insert(0, directory)
+    
+    # Regexes are compiled on first use either way, so only the import (or load) is timed
+    def imported():
+        sys.modules.pop(module, None)
+        __import__(module)
+        
+    def loaded():
+        sys.modules.pop(module, None)
+        routetable.load(path, module)
+    
+    try:
+        # Also writes the module's .pyc
+        routetable.save(path, module)
+        report('route table load (%d patterns, verbs=%d)' % (size, verbs), params=dict(size=size, verbs=verbs),
+            before=best_of(imported, number, repeat=3),
+            after=best_of(loaded, number, repeat=3)
+        )
+    finally:
+        sys.path.remove(directory)
+        sys.modules.pop(module, None)
+        shutil.rmtree(directory)
+
+def run_suite(sizes):
+    for size in sizes:
+        bench_urlconf(size)
+        bench_urlconf(size, depth=5)
+        bench_urlconf(size, verbs=5)
+        bench_urlconf(size, nesting=3)
+        bench_urlconf(size, matcher='indexed')
+        bench_routetable(size)
+
+def run_focused():
+    for depth in (0, 1, 5, 8):
+        bench_wrapper_dispatch(depth)
+    bench_resolver_match()
+    bench_pattern_memory()
+    for size in (10, 300):
+        bench_group_resolve(size, matcher='compiled')
+        bench_group_resolve(size, matcher='indexed')
+        bench_group_resolve(size, cache_size=1000)
+        bench_adaptive(size)
+    for resources in (10, 100):
+        bench_verb_resolve(resources)
+    bench_method_override()
+    for size in (10, 300):
+        bench_redirect(size)
+    bench_instrumentation()
+    bench_response_cache()
+    bench_concurrency_limit()
+    bench_head()
+
+if __name__ == '__main__':
+    parser = OptionParser(description='Compares reroute with plain Django (before) or with the unoptimized code path (after vs. before).')
+    parser.add_option('--sizes', default='10,100,1000,10000', help='comma-separated pattern counts for the synthetic urlconfs [%default]')
+    parser.add_option('--suite-only', action='store_true', help="only run the synthetic urlconf suite")
+    parser.add_option('--json', metavar='FILE', help='write the results to FILE as JSON')
+    options, args = parser.parse_args()
+    
+    if not options.suite_only:
+        run_focused()
+    run_suite([int(size) for size in options.sizes.split(',')])
+    
+    if options.json:
+        with open(options.json, 'w') as results:
+            json.dump(RESULTS, results, indent=2, sort_keys=True)
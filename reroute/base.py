@@ -30,24 +30,121 @@ try:
 except ImportError:
     ResolverMatch = None
 
-from utils import rollup
+import instrumentation
+from resolvers import ReroutePatternGroup
+from utils import NO_ARGS, compiled_regex, rollup, shared_source, shared_wrappers
 
-class RerouteRegexURLPattern(RegexURLPattern):
-    _configured = False
+class CompactPattern(RegexURLPattern):
+    '''A RegexURLPattern that keeps its attributes in slots, since urlconfs can hold tens of
+    thousands of patterns in every worker process. Patterns with the same regex source share the
+    source and its compiled regex, and patterns without default arguments share NO_ARGS.'''
+    
+    # Django's attributes. Slots take precedence over the instance dict, which is never made
+    # unless other attributes are set.
+    __slots__ = ('_regex', '_regex_dict', '_callback', '_callback_str', 'default_args', 'name', '_compiled')
+    
+    def __init__(self, regex, callback, default_args=None, name=None):
+        super(CompactPattern, self).__init__(shared_source(regex), callback, default_args, name)
+        if not self.default_args:
+            self.default_args = NO_ARGS
+        # Only translated regexes are compiled per language
+        if isinstance(self._regex, basestring):
+            self._regex_dict = None
+        self._compiled = None
+    
+    @property
+    def regex(self):
+        compiled = self._compiled
+        if compiled is None:
+            regex = self._regex
+            if not isinstance(regex, basestring):
+                return RegexURLPattern.regex.fget(self)
+            # The pattern holds its compiled regex, so the shared one lives as long as a pattern
+            # uses it, and takes the shared copy of the source
+            compiled = self._compiled = compiled_regex(regex)
+            if type(compiled.pattern) is type(regex):
+                self._regex = compiled.pattern
+        return compiled
+
+class RerouteRegexURLPattern(CompactPattern):
+    __slots__ = ('_wrappers', '_configured', '_composed', '_pattern_callback', 'reroute_group')
+    
+    def __init__(self, *args, **kwargs):
+        super(RerouteRegexURLPattern, self).__init__(*args, **kwargs)
+        self._configured = False
+        self._wrappers = ()
+        
+        # The (callback, composed wrapper chain) of the pattern's own view, once composed
+        self._composed = None
+        
+        # The callback returned by resolve (see PatternCallback), made on first use
+        self._pattern_callback = None
+        
+        # The ReroutePatternGroup that resolves this pattern, if any
+        self.reroute_group = None
     
     def reroute_config(self, wrappers, patterns_id):
         self.wrappers = wrappers
         self._configured = True
         
+        if self.reroute_group is not None:
+            self.reroute_group.clear_cache()
+        
+        # String views are imported lazily (on first resolve), so only compose callbacks that
+        # are already available.
+        if self._callback is not None:
+            self.compose(self._callback)
+    
+    def _get_wrappers(self):
+        return self._wrappers
+    
+    def _set_wrappers(self, wrappers):
+        self._wrappers = shared_wrappers(wrappers)
+        self.discard_composed()
+    
+    wrappers = property(_get_wrappers, _set_wrappers)
+    
+    def add_prefix(self, prefix):
+        super(RerouteRegexURLPattern, self).add_prefix(prefix)
+        self.discard_composed()
+    
+    def discard_composed(self):
+        '''Forgets every composed wrapper chain. Called whenever the wrappers or the callback
+        may have changed.'''
+        
+        self._composed = None
+    
+    def compose(self, callback):
+        '''Returns callback wrapped by this pattern's wrappers. The wrapper chain of the pattern's
+        own view is built once and reused for every request; assigning new wrappers discards it.'''
+        
+        composed = self._composed
+        if composed is not None and composed[0] is callback:
+            return composed[1]
+        chain = rollup(callback, self._wrappers)
+        if self._configured and callback is self._callback:
+            self._composed = (callback, chain)
+        return chain
+        
     def reroute_callback(self, request, *args, **kwargs):
-        callback = rollup(self.callback, self.wrappers)
+        if instrumentation.observers:
+            # Imported here since verbs imports this module
+            from verbs import request_method
+            return instrumentation.timed_call(self, request_method(request), self.callback, self.wrappers, request, *args, **kwargs)
+        
+        callback = self.compose(self.callback)
         return callback(request, *args, **kwargs)
                   
     def resolve(self, path):
-        # Lifted from django.core.urlresolvers.RegexURLPattern.resolve
         if not self._configured:
             raise ImproperlyConfigured('RerouteRegexURLPattern patterns must be used within reroute.patterns or reroute_patterns (for pattern %r)' % self.regex.pattern)
         
+        if instrumentation.observers:
+            return instrumentation.timed_resolve(self, path)
+        return self.match_path(path)
+    
+    def match_path(self, path):
+        # Lifted from django.core.urlresolvers.RegexURLPattern.resolve
         match = self.regex.search(path)
         if match:
             # If there are any named groups, use those as kwargs, ignoring
@@ -58,33 +155,90 @@ class RerouteRegexURLPattern(RegexURLPattern):
                 args = ()
             else:
                 args = match.groups()
-            # In both cases, pass any extra_kwargs as **kwargs.
+            return self.resolver_match(args, kwargs)
+    
+    def resolver_match(self, args, kwargs):
+        '''Returns the result of resolve given the arguments captured by this pattern's regex.
+        Used by reroute.resolvers to resolve patterns that were matched as part of a group.'''
+        
+        # In both cases, pass any extra_kwargs as **kwargs.
+        if self.default_args:
             kwargs.update(self.default_args)
+        
+        callback = self._pattern_callback
+        if callback is None:
+            callback = self._pattern_callback = PatternCallback(self)
+        
+        # Django 1.3 compatibility
+        if ResolverMatch:
+            return ResolverMatch(callback, args, kwargs, self.name)
+        else:
+            return callback, args, kwargs
+
+class PatternCallback(object):
+    '''The callback resolve returns for a RerouteRegexURLPattern: calls the pattern's
+    reroute_callback. One instance is made per pattern and reused for every request. Its other
+    attributes (like csrf_exempt, which Django's middleware looks for) are those of the pattern's
+    view.'''
+    
+    # Looked up by Django on every request, so they're copied rather than found by __getattr__
+    COPIED = ('__module__', '__name__', 'csrf_exempt')
+    
+    def __init__(self, pattern):
+        self.pattern = pattern
+        for name in self.COPIED:
+            if hasattr(pattern.callback, name):
+                setattr(self, name, getattr(pattern.callback, name))
+        
+    def __call__(self, request, *args, **kwargs):
+        return self.pattern.reroute_callback(request, *args, **kwargs)
+        
+    def __getattr__(self, name):
+        if name == 'pattern':
+            raise AttributeError(name)
+        return getattr(self.pattern.callback, name)
 
-            # We unfortunately need another wrapper here since arbitrary attributes can't be set
-            # on an instancemethod
-            callback = lambda request, *args, **kwargs: self.reroute_callback(request, *args, **kwargs)
-            
-            if hasattr(self.callback, 'csrf_exempt'):
-                callback.csrf_exempt = self.callback.csrf_exempt
+class ReversePattern(CompactPattern):
+    '''Stands in for a pattern whose requests are resolved by another pattern of the same group
+    (like the duplicate regexes of a verb_url group). It keeps the regex, callback and name so
+    reverse() is unaffected, but never matches a path.'''
+    
+    __slots__ = ()
+    
+    reverse_only = True
+    
+    def __init__(self, pattern):
+        # Translated (lazy) regexes must stay lazy
+        regex = getattr(pattern, '_regex', None) or pattern.regex.pattern
+        super(ReversePattern, self).__init__(regex, pattern.callback, pattern.default_args, pattern.name)
+    
+    def resolve(self, path):
+        return None
 
-            # Django 1.3 compatibility
-            if ResolverMatch:
-                return ResolverMatch(callback, args, kwargs, self.name)
-            else:
-                return callback, args, kwargs
+class PatternsId(object):
+    '''Identifies one call to reroute_patterns. State that patterns share with the other
+    patterns of the same call can be weakly keyed by it, so it's freed once configuration is
+    done.'''
+    
+    __slots__ = ('__weakref__',)
 
-def reroute_patterns(wrappers, prefix, *args):
+def reroute_patterns(wrappers, prefix, *args, **options):
     # TODO(dnerdy) Require that all patterns be instances of RerouteRegexURLPattern
-    # TODO(dnerdy) Remove additional patterns with identical regexes, if present (occurs
-    #   when using verb_url)
     
-    patterns_id = object()
+    patterns_id = PatternsId()
     pattern_list = django_patterns(prefix, *args)
     
     for pattern in pattern_list:
         if isinstance(pattern, RerouteRegexURLPattern):            
             pattern.reroute_config(wrappers, patterns_id)
+    
+    # Patterns that another pattern now resolves on their behalf only need to be reversible
+    pattern_list = [ReversePattern(pattern) if getattr(pattern, 'collapsed', False) else pattern for pattern in pattern_list]
+    
+    # Options (like matcher='compiled') turn the group into a single resolver that matches the
+    # patterns as a whole. See reroute.resolvers.
+    if options:
+        return [ReroutePatternGroup(pattern_list, **options)]
         
     return pattern_list
     
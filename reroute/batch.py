@@ -0,0 +1,214 @@
+# Copyright (c) 2010 Mark Sandstrom
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''A view that handles a batch of sub-requests in one request.
+
+The batch is a POST whose body is a JSON list of sub-requests:
+    [
+        {"method": "GET", "path": "/products/1/"},
+        {"method": "PUT", "path": "/products/2/", "body": "name=Lamp",
+         "headers": {"Content-Type": "application/x-www-form-urlencoded"}}
+    ]
+
+Each sub-request is resolved with the batch request's urlconf and its view is called, so
+reroute wrappers and verb_url dispatch apply as usual. Sub-requests carry the batch request's
+headers (cookies included) and the attributes middleware set on it (like user and session), but
+middleware doesn't run for them. The response is a JSON list with the status, headers and body of
+each sub-request's response, in order.
+
+Example:
+    from reroute.batch import batch_view
+    
+    urlpatterns = patterns('',
+        url('^batch$', batch_view(workers=4)),
+    )
+'''
+
+import json
+import logging
+import sys
+import threading
+from cStringIO import StringIO
+from multiprocessing.pool import ThreadPool
+
+from django.core.urlresolvers import Resolver404, get_script_prefix, get_urlconf, resolve, set_script_prefix, set_urlconf
+from django.http import Http404, HttpResponse
+from django.utils import translation
+
+__all__ = ['batch_view']
+
+logger = logging.getLogger('django.request')
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# The headers of the batch request that don't apply to its sub-requests
+BATCH_HEADERS = ('CONTENT_TYPE', 'CONTENT_LENGTH', 'HTTP_X_HTTP_METHOD_OVERRIDE')
+
+class BatchError(ValueError):
+    '''Raised for batches that are malformed or too large, with the status of the response.'''
+    
+    def __init__(self, message, status=400):
+        super(BatchError, self).__init__(message)
+        self.status = status
+
+def meta_name(header):
+    name = str(header.upper().replace('-', '_'))
+    if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+        return name
+    return 'HTTP_' + name
+
+def parse_batch(request, max_requests, max_size):
+    '''Returns the list of (method, path, body, headers) tuples of a batch request.'''
+    
+    try:
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        content_length = 0
+    data = request.read(max_size + 1) if content_length <= max_size else ''
+    if content_length > max_size or len(data) > max_size:
+        raise BatchError('The batch is larger than %d bytes' % max_size, 413)
+    
+    try:
+        items = json.loads(data)
+    except ValueError:
+        raise BatchError('The batch is not valid JSON')
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        raise BatchError('The batch must be a list of objects')
+    if len(items) > max_requests:
+        raise BatchError('The batch has more than %d requests' % max_requests, 413)
+    
+    batch = []
+    for item in items:
+        method = item.get('method') or 'GET'
+        path = item.get('path')
+        body = item.get('body') or ''
+        headers = item.get('headers') or {}
+        if not isinstance(method, basestring) or not method.isalpha():
+            raise BatchError('Request methods must be names like "GET"')
+        if not isinstance(path, basestring) or not path.startswith('/'):
+            raise BatchError('Every request needs an absolute path')
+        if not isinstance(body, basestring) or not isinstance(headers, dict) or not all(isinstance(value, basestring) for value in headers.itervalues()):
+            raise BatchError('Request bodies must be strings, and headers objects with string values')
+        headers = dict((meta_name(header), value.encode('utf-8')) for header, value in headers.iteritems())
+        batch.append((str(method.upper()), path, body.encode('utf-8'), headers))
+    return batch
+
+def sub_request(request, method, path, body, headers):
+    '''Returns a copy of request (a WSGIRequest) for the sub-request.'''
+    
+    path, _, query = path.partition('?')
+    environ = dict(request.META)
+    for name in BATCH_HEADERS:
+        environ.pop(name, None)
+    environ.update(headers)
+    environ.setdefault('CONTENT_TYPE', 'application/x-www-form-urlencoded')
+    environ.update({
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path.encode('utf-8'),
+        'QUERY_STRING': query.encode('utf-8'),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': StringIO(body),
+    })
+    
+    sub = request.__class__(environ)
+    # Attributes added by middleware (user, session, ...)
+    for name, value in request.__dict__.iteritems():
+        if not name.startswith('_') and name not in sub.__dict__:
+            setattr(sub, name, value)
+    sub._reroute_batch = True
+    return sub
+
+def call(request, urlconf):
+    '''Returns the response of the view request resolves to.'''
+    
+    try:
+        callback, args, kwargs = resolve(request.path_info, urlconf)
+        return callback(request, *args, **kwargs)
+    except (Resolver404, Http404):
+        return HttpResponse(status=404)
+    except Exception:
+        logger.error('Internal Server Error: %s', request.path, exc_info=sys.exc_info(), extra={'status_code': 500, 'request': request})
+        return HttpResponse(status=500)
+
+def describe(response):
+    charset = getattr(response, '_charset', 'utf-8')
+    return {
+        'status': response.status_code,
+        'headers': dict(response.items()),
+        'body': ''.join(response).decode(charset, 'replace'),
+    }
+
+def batch_view(max_requests=20, max_size=1024 * 1024, workers=None):
+    '''Returns a view that handles batches of at most max_requests sub-requests and max_size
+    bytes. With workers, batches of GET, HEAD and OPTIONS requests are handled concurrently by a
+    pool of that many threads; other batches are handled in order.'''
+    
+    pools = []
+    lock = threading.Lock()
+    
+    def pool():
+        with lock:
+            if not pools:
+                pools.append(ThreadPool(workers))
+        return pools[0]
+    
+    def view(request):
+        if request.method != 'POST':
+            response = HttpResponse(status=405)
+            response['Allow'] = 'POST'
+            return response
+        if getattr(request, '_reroute_batch', False):
+            return HttpResponse('Batches can not be nested', status=400, content_type='text/plain')
+        
+        try:
+            batch = parse_batch(request, max_requests, max_size)
+        except BatchError, e:
+            return HttpResponse(str(e), status=e.status, content_type='text/plain')
+        
+        urlconf = getattr(request, 'urlconf', None) or get_urlconf()
+        subs = [sub_request(request, *item) for item in batch]
+        
+        if workers and len(subs) > 1 and all(sub.method in SAFE_METHODS for sub in subs):
+            # Imported here since django.db reads the settings on import
+            from django.db import close_connection
+            
+            # The urlconf, language and script prefix are thread-local
+            language = translation.get_language()
+            script_prefix = get_script_prefix()
+            
+            def call_in_thread(sub):
+                set_urlconf(urlconf)
+                set_script_prefix(script_prefix)
+                translation.activate(language)
+                try:
+                    return describe(call(sub, urlconf))
+                finally:
+                    translation.deactivate()
+                    set_urlconf(None)
+                    # Database connections are per thread, and only the request_finished
+                    # signal closes them, which pool threads never send
+                    close_connection()
+            
+            results = pool().map(call_in_thread, subs)
+        else:
+            results = [describe(call(sub, urlconf)) for sub in subs]
+        
+        return HttpResponse(json.dumps(results), content_type='application/json')
+    return view
@@ -0,0 +1,191 @@
+# Copyright (c) 2010 Mark Sandstrom
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''A reroute wrapper that caches whole responses.
+
+Example:
+    from reroute.caching import ResponseCache
+    
+    urlpatterns = reroute_patterns([ResponseCache(timeout=60, vary=['Accept-Language'])], 'app.views',
+        url(r'^products/(?P<id>\d+)/$', 'product'),
+    )
+'''
+
+import hashlib
+import threading
+import time
+
+from django.http import HttpResponse
+
+from decorators import HeadOnlyResponse
+from resolvers import ResolveCache
+
+__all__ = ['ResponseCache']
+
+def cacheable(response):
+    '''Returns True if response can be stored and served to other clients.'''
+    
+    if response.status_code != 200 or response.cookies:
+        return False
+    # The body of @render's unrendered HEAD responses isn't the page's, and their length isn't known
+    if isinstance(response, HeadOnlyResponse):
+        return False
+    # Streamed responses can't be read without consuming them
+    if getattr(response, 'streaming', False) or getattr(response, '_base_content_is_iter', False):
+        return False
+    cache_control = response.get('Cache-Control', '').lower()
+    return not any(directive in cache_control for directive in ('private', 'no-cache', 'no-store'))
+
+def vary_headers(response):
+    '''Returns the request.META names of the headers listed in the Vary header of response.'''
+    
+    return set('HTTP_' + header.strip().upper().replace('-', '_') for header in response.get('Vary', '').split(',') if header.strip())
+
+def cached_response(entry):
+    '''Returns a new response for a cache entry, so clients never share a response object.'''
+    
+    expires, status, content, headers = entry
+    response = HttpResponse(content, status=status)
+    for header, value in headers:
+        response[header] = value
+    return response
+
+class ResponseCache(object):
+    '''A wrapper that caches the responses of GET and HEAD requests for timeout seconds.
+    
+    Responses are cached by request method, path, query string and the values of the request
+    headers listed in vary (the path identifies the resolved pattern along with its arguments).
+    Only 200 responses that don't set cookies, aren't streamed, aren't @render's unrendered HEAD
+    responses and aren't marked private, no-cache or no-store are cached. Responses whose Vary header (set by @vary_on_cookie, for
+    example) names a header that isn't listed in vary aren't cached either, since they'd be served
+    to requests with other values of that header. Other methods always go to the view.
+    
+    Only one request per key renders a response at a time (per process): while it does, the other
+    requests for the key get the expired response if it expired less than stale seconds ago, or
+    wait up to wait seconds for the new one (and go to the view themselves if it's not ready by
+    then).
+    
+    Responses are kept in an in-process LRU cache of max_size entries, or in the Django cache
+    named by cache (like 'default'), which can also be a cache object. hits, misses and
+    stale_hits count the requests of each kind.
+    '''
+    
+    SAFE_METHODS = ('GET', 'HEAD')
+    
+    def __init__(self, timeout=300, vary=(), max_size=1000, stale=30, wait=5.0, cache=None, key_prefix='reroute.response'):
+        self.timeout = timeout
+        self.stale = stale
+        self.wait = wait
+        self.vary = tuple('HTTP_' + header.upper().replace('-', '_') for header in vary)
+        self._vary_set = frozenset(self.vary)
+        self.key_prefix = key_prefix
+        
+        if cache is None:
+            self.entries = ResolveCache(max_size)
+            self.backend = None
+        else:
+            self.entries = None
+            if isinstance(cache, basestring):
+                # Imported here since django.core.cache reads the settings on import
+                from django.core.cache import get_cache
+                cache = get_cache(cache)
+            self.backend = cache
+        
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        
+        # Maps the keys being rendered to an Event that's set when they're done
+        self._rendering = {}
+        self._lock = threading.Lock()
+    
+    def __repr__(self):
+        return '<%s timeout=%s>' % (self.__class__.__name__, self.timeout)
+    
+    def key(self, request):
+        # request_method only overrides POST, so a safe method is already the effective one
+        key = (request.method, getattr(request, 'urlconf', None), request.path_info, request.META.get('QUERY_STRING', ''))
+        if self.vary:
+            key += tuple(request.META.get(header) for header in self.vary)
+        if self.backend is not None:
+            # Django cache keys have to be short strings
+            key = '%s.%s' % (self.key_prefix, hashlib.md5(repr(key)).hexdigest())
+        return key
+    
+    def get(self, key):
+        if self.backend is None:
+            return self.entries.get(key)
+        return self.backend.get(key)
+    
+    def set(self, key, response):
+        entry = (time.time() + self.timeout, response.status_code, response.content, response.items())
+        if self.backend is None:
+            self.entries.set(key, entry)
+        else:
+            self.backend.set(key, entry, self.timeout + self.stale)
+    
+    def count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+    
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'stale_hits': self.stale_hits}
+    
+    def __call__(self, view, request, *args, **kwargs):
+        if request.method not in self.SAFE_METHODS:
+            return view(request, *args, **kwargs)
+        
+        key = self.key(request)
+        entry = self.get(key)
+        now = time.time()
+        if entry is not None:
+            if entry[0] > now:
+                self.count('hits')
+                return cached_response(entry)
+            if entry[0] + self.stale <= now:
+                entry = None
+        
+        with self._lock:
+            rendering = self._rendering.get(key)
+            if rendering is None:
+                done = self._rendering[key] = threading.Event()
+        
+        if rendering is not None:
+            if entry is not None:
+                self.count('stale_hits')
+                return cached_response(entry)
+            rendering.wait(self.wait)
+            entry = self.get(key)
+            if entry is not None and entry[0] + self.stale > time.time():
+                self.count('hits')
+                return cached_response(entry)
+            self.count('misses')
+            return view(request, *args, **kwargs)
+        
+        try:
+            self.count('misses')
+            response = view(request, *args, **kwargs)
+            if cacheable(response) and vary_headers(response) <= self._vary_set:
+                self.set(key, response)
+            return response
+        finally:
+            with self._lock:
+                del self._rendering[key]
+            done.set()
@@ -18,17 +18,108 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN 
 # THE SOFTWARE.
 
+import re
+from calendar import timegm
 from functools import wraps
+from weakref import WeakKeyDictionary
 
-from django.core.urlresolvers import reverse
-from django.http import HttpResponseRedirect
-from django.shortcuts import render_to_response
-from django.template import RequestContext
+from django.conf import settings
+from django.core.urlresolvers import get_callable, get_resolver, get_script_prefix, get_urlconf, reverse
+from django.http import HttpResponse, HttpResponseNotModified, HttpResponseRedirect
+from django.template import Node, RequestContext, loader
+from django.utils.encoding import force_unicode, iri_to_uri
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from django.utils.regex_helper import normalize
+from django.utils.translation import get_language
+
+from verbs import head_only
+
+# Django < 1.5 compatibility: HttpResponse reads its iterator whenever middleware asks for its
+# content, so there's no way to stream a response
+try:
+    from django.http import StreamingHttpResponse
+except ImportError:
+    StreamingHttpResponse = None
 
 CONFLICTING_CONTEXTS = 'The view {module}.{view} and @render define conflicting contexts. These keys collide: {keys}'
 
-def render(template, **extra_context):
+def load_template(template):
+    '''Returns the Template named by template, or the first one that exists if it's a list or
+    tuple of names (like render_to_response).'''
+    
+    if isinstance(template, (list, tuple)):
+        return loader.select_template(template)
+    return loader.get_template(template)
+
+def render_chunks(template, context):
+    '''Renders template one top-level node at a time. A template that extends another one is a
+    single node, so it's rendered in one piece.'''
+    
+    # Lifted from django.template.base.Template.render and NodeList.render
+    nodelist = template.nodelist
+    context.render_context.push()
+    try:
+        for node in nodelist:
+            if isinstance(node, Node):
+                node = nodelist.render_node(node, context)
+            yield force_unicode(node)
+    finally:
+        context.render_context.pop()
+
+class HeadOnlyResponse(HttpResponse):
+    '''The response @render returns without rendering for head_only requests. Its length isn't
+    known, so it never carries a Content-Length header (middleware like ConditionalGetMiddleware
+    would otherwise report the length of the empty body, which differs from GET's).'''
+    
+    def __setitem__(self, header, value):
+        if header.lower() != 'content-length':
+            super(HeadOnlyResponse, self).__setitem__(header, value)
+
+def not_modified(request, etag, last_modified):
+    '''Returns True if the client's copy of a resource with the given ETag and last modified
+    timestamp (either may be None) is current, according to the request's If-None-Match and
+    If-Modified-Since headers. Only GET and HEAD requests can be answered with a 304.'''
+    
+    # Lifted from django.views.decorators.http.condition
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    
+    if_modified_since = request.META.get('HTTP_IF_MODIFIED_SINCE')
+    if if_modified_since:
+        if_modified_since = parse_http_date_safe(if_modified_since)
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        try:
+            etags = parse_etags(if_none_match)
+        except ValueError:
+            # Ignore invalid ETag headers (Django bug #10681)
+            if_none_match = None
+    
+    if if_none_match:
+        return bool(etag and (etag in etags or '*' in etags) and
+            (not if_modified_since or (last_modified and last_modified <= if_modified_since)))
+    return bool(request.method == 'GET' and last_modified and if_modified_since and last_modified <= if_modified_since)
+
+def render(template, stream=False, etag=None, last_modified=None, **extra_context):
+    '''Renders template with the dict returned by the view (and extra_context) using a
+    RequestContext. The template is loaded once, or for every request when DEBUG is on. With
+    stream=True the response is rendered in chunks as it's sent (Django 1.5 and later; older
+    versions render it in one piece).
+    
+    etag and last_modified are optional callables that take the request and the context and
+    return the resource's ETag (a string) or last modified time (a datetime). When the client's
+    copy is current, the response is a 304 and the template isn't rendered. It isn't rendered
+    either for HEAD requests that a verb_url group sent to its GET view (see
+    reroute.verbs.head_only).'''
+    
     def decorator(func):
+        loaded = []
+        
+        def get_template():
+            if settings.DEBUG or not loaded:
+                loaded[:] = [load_template(template)]
+            return loaded[0]
+        
         @wraps(func)
         def wrapper(request, *args, **kwargs):
             response = func(request, *args, **kwargs)
@@ -41,20 +132,122 @@ def render(template, **extra_context):
                         keys = ', '.join(common_keys)
                     ))
                 response.update(extra_context)
-                response = render_to_response(template, response, context_instance=RequestContext(request))
+                
+                res_etag = etag(request, response) if etag else None
+                res_last_modified = last_modified(request, response) if last_modified else None
+                if res_last_modified:
+                    res_last_modified = timegm(res_last_modified.utctimetuple())
+                
+                if (res_etag or res_last_modified) and not_modified(request, res_etag, res_last_modified):
+                    response = HttpResponseNotModified()
+                elif head_only(request) and not settings.USE_ETAGS:
+                    # The body would be discarded (USE_ETAGS derives the ETag from it)
+                    response = HeadOnlyResponse()
+                else:
+                    # Same precedence as render_to_response: the view's values override the
+                    # context processors'
+                    context = RequestContext(request)
+                    context.update(response)
+                    
+                    if stream and StreamingHttpResponse is not None:
+                        response = StreamingHttpResponse(render_chunks(get_template(), context))
+                    else:
+                        response = HttpResponse(get_template().render(context))
+                
+                if res_etag:
+                    response['ETag'] = quote_etag(res_etag)
+                if res_last_modified:
+                    response['Last-Modified'] = http_date(res_last_modified)
                 return response
             else:
                 return response
         return wrapper
     return decorator
 
+class URLBuilder(object):
+    '''Builds the URLs of a view like reverse(viewname, kwargs=kwargs), except that the view is
+    looked up and its patterns are compiled only once. A builder is only valid for the resolver
+    it was made from (clear_url_caches replaces the resolvers), and doesn't keep it alive.'''
+    
+    def __init__(self, resolver, viewname):
+        self.viewname = viewname
+        self._regexes = {}
+        
+        # Lifted from django.core.urlresolvers.RegexURLResolver._reverse_with_prefix. The resolver
+        # fills in _callback_strs when it's populated, on first access to reverse_dict.
+        reverse_dict = resolver.reverse_dict
+        lookup_view = viewname
+        if lookup_view in getattr(resolver, '_callback_strs', ()):
+            try:
+                lookup_view = get_callable(lookup_view, True)
+            except (ImportError, AttributeError):
+                # Left for reverse() to report
+                pass
+        
+        self.candidates = []
+        for possibility, pattern, defaults in reverse_dict.getlist(lookup_view):
+            for result, params in possibility:
+                self.candidates.append((set(params + defaults.keys()), result, pattern, defaults))
+        
+    def _prefix(self, prefix):
+        try:
+            return self._regexes[prefix]
+        except KeyError:
+            prefix_norm, prefix_args = normalize(prefix)[0]
+            compiled = self._regexes[prefix] = (prefix_norm, set(prefix_args), dict(
+                (pattern, re.compile(u'^%s%s' % (prefix, pattern), re.UNICODE))
+                for keys, result, pattern, defaults in self.candidates
+            ))
+            return compiled
+        
+    def build(self, kwargs, prefix):
+        '''Returns the URL, or None if the view has no pattern that matches kwargs.'''
+        
+        prefix_norm, prefix_args, regexes = self._prefix(prefix)
+        for keys, result, pattern, defaults in self.candidates:
+            if set(kwargs.keys() + defaults.keys()) != keys | prefix_args:
+                continue
+            if any(kwargs.get(k, v) != v for k, v in defaults.iteritems()):
+                continue
+            unicode_kwargs = dict((k, force_unicode(v)) for k, v in kwargs.iteritems())
+            candidate = (prefix_norm + result) % unicode_kwargs
+            if regexes[pattern].search(candidate):
+                if candidate.startswith('//'):
+                    candidate = '/%%2F%s' % candidate[2:]
+                return iri_to_uri(candidate)
+        return None
+
 def redirect(reverse_viewname):
+    '''Redirects to reverse(reverse_viewname, kwargs=...) with the dict returned by the view.
+    The URL is built by a URLBuilder that's kept as long as the resolver of the urlconf.'''
+    
     def decorator(func):
+        # Maps each resolver to a builder per language. Resolvers that are replaced (or whose
+        # urlconf is discarded) are dropped along with their builders.
+        builders = WeakKeyDictionary()
+        
+        def url(kwargs):
+            # Namespaced view names are left to reverse()
+            if isinstance(reverse_viewname, basestring) and ':' in reverse_viewname:
+                return reverse(reverse_viewname, kwargs=kwargs)
+            
+            resolver = get_resolver(get_urlconf())
+            language = get_language()
+            by_language = builders.get(resolver)
+            if by_language is None:
+                by_language = builders[resolver] = {}
+            builder = by_language.get(language)
+            if builder is None:
+                builder = by_language[language] = URLBuilder(resolver, reverse_viewname)
+            
+            # reverse() raises the appropriate NoReverseMatch
+            return builder.build(kwargs, get_script_prefix()) or reverse(reverse_viewname, kwargs=kwargs)
+        
         @wraps(func)
         def wrapper(*args, **kwargs):
             response = func(*args, **kwargs)
             if isinstance(response, dict):
-                return HttpResponseRedirect(reverse(reverse_viewname, kwargs=response))
+                return HttpResponseRedirect(url(response))
             else:
                 return response
         return wrapper
@@ -0,0 +1,198 @@
+# Copyright (c) 2010 Mark Sandstrom
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''Opt-in timing of reroute patterns.
+
+An observer is a callable that's called as observer(kind, name, method, elapsed, wrapper):
+    kind: 'resolve', 'wrapper' or 'view'
+    name: the pattern's name, or its regex if it doesn't have one
+    method: the effective HTTP method (None for 'resolve', which happens outside of a request)
+    elapsed: seconds spent. For wrappers this excludes the time spent in the rest of the chain.
+    wrapper: the wrapper, for 'wrapper' events (None otherwise)
+
+While no observer is registered, patterns only pay for checking that the observers list is empty.
+'''
+
+import json
+import math
+import threading
+from functools import partial
+from timeit import default_timer as timer
+
+from django.http import HttpResponse
+
+__all__ = ['register', 'unregister', 'Histogram', 'Aggregator', 'stats_view']
+
+# Replaced (never modified) by register and unregister, so it can be iterated without a lock
+observers = ()
+
+def register(observer):
+    global observers
+    observers = observers + (observer,)
+
+def unregister(observer):
+    global observers
+    observers = tuple(registered for registered in observers if registered is not observer)
+
+def emit(kind, name, method, elapsed, wrapper=None):
+    for observer in observers:
+        observer(kind, name, method, elapsed, wrapper)
+
+def pattern_label(pattern):
+    return pattern.name or pattern.regex.pattern
+
+def wrapper_label(wrapper):
+    # Wrapper instances (like ResponseCache) have no __name__
+    return getattr(wrapper, '__name__', None) or type(wrapper).__name__
+
+def timed_resolve(pattern, path):
+    start = timer()
+    try:
+        return pattern.match_path(path)
+    finally:
+        emit('resolve', pattern_label(pattern), None, timer() - start)
+
+def timed_call(pattern, method, callback, wrappers, request, *args, **kwargs):
+    '''Calls callback wrapped by wrappers (like rollup), reporting the time spent in each
+    wrapper and in the view.'''
+    
+    name = pattern_label(pattern)
+    # The inclusive time of the layer that returned last
+    inner = [0.0]
+    
+    def view(request, *args, **kwargs):
+        start = timer()
+        try:
+            return callback(request, *args, **kwargs)
+        finally:
+            inner[0] = elapsed = timer() - start
+            emit('view', name, method, elapsed)
+    
+    def layer(wrapper, function, request, *args, **kwargs):
+        inner[0] = 0.0
+        start = timer()
+        try:
+            return wrapper(function, request, *args, **kwargs)
+        finally:
+            elapsed = timer() - start
+            emit('wrapper', name, method, elapsed - inner[0], wrapper)
+            inner[0] = elapsed
+    
+    function = view
+    for wrapper in reversed(wrappers):
+        function = partial(layer, wrapper, function)
+    return function(request, *args, **kwargs)
+
+class Histogram(object):
+    '''Counts timings in logarithmic buckets (about 9% wide, from 1us to 100s) so percentiles can
+    be estimated in constant memory.'''
+    
+    SMALLEST = 1e-6
+    GROWTH = 2 ** 0.125
+    BUCKETS = int(math.log(1e2 / SMALLEST, GROWTH)) + 1
+    
+    def __init__(self):
+        self.counts = [0] * (self.BUCKETS + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+    
+    def add(self, elapsed):
+        if elapsed <= self.SMALLEST:
+            bucket = 0
+        else:
+            bucket = min(int(math.log(elapsed / self.SMALLEST, self.GROWTH)) + 1, self.BUCKETS)
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += elapsed
+        self.maximum = max(self.maximum, elapsed)
+    
+    def percentile(self, percent):
+        '''Returns the upper bound of the bucket holding the given percentile (0 if empty).'''
+        
+        if not self.count:
+            return 0.0
+        rank = math.ceil(self.count * percent / 100.0)
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.SMALLEST * self.GROWTH ** bucket, self.maximum)
+        return self.maximum
+    
+    def summary(self, percentiles):
+        summary = {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'max': self.maximum,
+        }
+        for percent in percentiles:
+            summary['p%g' % percent] = self.percentile(percent)
+        return summary
+
+class Aggregator(object):
+    '''An observer that keeps a Histogram per kind, pattern name, HTTP method and wrapper.
+    
+    Example:
+        aggregator = Aggregator()
+        instrumentation.register(aggregator)
+        
+        urlpatterns += patterns('',
+            url('^stats$', stats_view(aggregator)),
+        )
+    '''
+    
+    PERCENTILES = (50, 90, 99)
+    
+    def __init__(self):
+        self.histograms = {}
+        self._lock = threading.Lock()
+    
+    def __call__(self, kind, name, method, elapsed, wrapper=None):
+        key = (kind, name, method, wrapper_label(wrapper) if wrapper else None)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.add(elapsed)
+    
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+    
+    def stats(self, percentiles=PERCENTILES):
+        '''Returns a list of dicts (sorted by kind, name, method and wrapper) describing each
+        histogram. Times are in seconds.'''
+        
+        with self._lock:
+            items = sorted(self.histograms.items())
+            stats = []
+            for (kind, name, method, wrapper), histogram in items:
+                entry = histogram.summary(percentiles)
+                entry.update(kind=kind, name=name, method=method, wrapper=wrapper)
+                stats.append(entry)
+        return stats
+
+def stats_view(aggregator):
+    '''Returns a view that responds with aggregator's stats as JSON.'''
+    
+    def view(request):
+        return HttpResponse(json.dumps(aggregator.stats(), indent=2), content_type='application/json')
+    return view
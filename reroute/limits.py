@@ -0,0 +1,144 @@
+# Copyright (c) 2010 Mark Sandstrom
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''A reroute wrapper that caps the number of requests a group of patterns handles at once, so a
+slow endpoint can't take every worker thread.
+
+Example:
+    from reroute.limits import ConcurrencyLimit
+    
+    urlpatterns = reroute_patterns([ConcurrencyLimit(10, timeout=0.5)], 'app.views',
+        url('^reports/$', 'reports'),
+    )
+'''
+
+import threading
+from timeit import default_timer as timer
+
+from django.http import HttpResponse
+
+from verbs import request_method
+
+__all__ = ['ConcurrencyLimit']
+
+# The methods that get their own limit with by='method'; the others share one
+HTTP_METHODS = frozenset(['GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS', 'TRACE'])
+
+class Slot(object):
+    '''Counts the requests in flight and waiting for one limit.'''
+    
+    def __init__(self, limit, queue):
+        self.limit = limit
+        self.queue = queue
+        self.in_flight = 0
+        self.waiting = 0
+        self.shed = 0
+        self._condition = threading.Condition(threading.Lock())
+    
+    def acquire(self, timeout):
+        '''Returns True once the request may proceed, or False if it's shed: if the limit is
+        still reached after waiting timeout seconds, or if queue requests are already waiting.'''
+        
+        with self._condition:
+            if self.in_flight >= self.limit and timeout > 0 and self.waiting < self.queue:
+                deadline = timer() + timeout
+                self.waiting += 1
+                try:
+                    while self.in_flight >= self.limit:
+                        remaining = deadline - timer()
+                        if remaining <= 0:
+                            break
+                        self._condition.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            
+            if self.in_flight >= self.limit:
+                self.shed += 1
+                return False
+            self.in_flight += 1
+            return True
+    
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+    
+    def stats(self):
+        return {'in_flight': self.in_flight, 'waiting': self.waiting, 'shed': self.shed}
+
+class ConcurrencyLimit(object):
+    '''A wrapper that lets at most limit requests through at once. Other requests wait up to
+    timeout seconds for one of them to finish (at most queue of them, limit by default), and are
+    otherwise answered right away with a 503 whose Retry-After header is retry_after seconds.
+    
+    Every pattern whose wrappers include the same ConcurrencyLimit shares its limit; give a
+    pattern its own instance to limit it separately. With by='method', each effective HTTP method
+    (see request_method) has its own limit.
+    
+    stats() maps each limit (None, or the method with by='method') to the number of requests in
+    flight, waiting, and shed so far. Methods that aren't in HTTP_METHODS share the None limit.
+    '''
+    
+    def __init__(self, limit, timeout=0.1, queue=None, retry_after=1, by=None):
+        if by not in (None, 'method'):
+            raise ValueError("ConcurrencyLimit's by must be None or 'method' (got %r)" % (by,))
+        
+        self.limit = limit
+        self.timeout = timeout
+        self.queue = limit if queue is None else queue
+        self.retry_after = retry_after
+        self.by = by
+        self.slots = {}
+        self._lock = threading.Lock()
+    
+    def __repr__(self):
+        return '<%s limit=%d>' % (self.__class__.__name__, self.limit)
+    
+    def slot(self, request):
+        key = None
+        if self.by == 'method':
+            key = request_method(request)
+            # Clients choose the method, so they mustn't be able to add limits at will
+            if key not in HTTP_METHODS:
+                key = None
+        slot = self.slots.get(key)
+        if slot is None:
+            with self._lock:
+                slot = self.slots.get(key)
+                if slot is None:
+                    slot = self.slots[key] = Slot(self.limit, self.queue)
+        return slot
+    
+    def shed_response(self):
+        response = HttpResponse('Service temporarily overloaded', status=503, content_type='text/plain')
+        response['Retry-After'] = str(self.retry_after)
+        return response
+    
+    def stats(self):
+        return dict((key, slot.stats()) for key, slot in self.slots.items())
+    
+    def __call__(self, view, request, *args, **kwargs):
+        slot = self.slot(request)
+        if not slot.acquire(self.timeout):
+            return self.shed_response()
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            slot.release()
@@ -0,0 +1,45 @@
+# Copyright (c) 2010 Mark Sandstrom
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from reroute.replay import replay_files
+
+class Command(BaseCommand):
+    help = 'Replays the requests of access logs through the urlconf and reports the patterns tried, resolve time and requests of each pattern, the unmatched paths and the shadowed verb_url groups.'
+    args = '<log> [<log> ...]'
+    
+    option_list = BaseCommand.option_list + (
+        make_option('--urlconf', help='The urlconf module to replay the logs through (ROOT_URLCONF by default)'),
+        make_option('--jobs', type='int', default=1, help='The number of processes that replay logs in parallel (one log per process at a time)'),
+        make_option('--limit', type='int', default=50, help='The number of rows of each section of the report'),
+    )
+    
+    def handle(self, *args, **options):
+        if not args:
+            raise CommandError('Usage: reroute_replay %s (- reads standard input)' % self.args)
+        
+        try:
+            replay = replay_files(args, options.get('urlconf'), options.get('jobs') or 1)
+        except IOError, e:
+            raise CommandError(str(e))
+        replay.report(self.stdout, options.get('limit'))
@@ -0,0 +1,41 @@
+# Copyright (c) 2010 Mark Sandstrom
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.exceptions import ImproperlyConfigured
+
+from reroute.routetable import save
+
+class Command(BaseCommand):
+    help = 'Saves the patterns of a urlconf to a route table file that reroute.routetable.load can use instead of importing the urlconf.'
+    args = '<urlconf> <file>'
+    
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError('Usage: reroute_routetable %s' % self.args)
+        urlconf, path = args
+        
+        try:
+            save(path, urlconf)
+        except ImproperlyConfigured, e:
+            raise CommandError(str(e))
+        
+        if int(options.get('verbosity', 1)) >= 1:
+            self.stdout.write('Saved the route table of %s to %s\n' % (urlconf, path))
@@ -0,0 +1,43 @@
+# Copyright (c) 2010 Mark Sandstrom
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from reroute.warmup import warm_up
+
+class Command(BaseCommand):
+    help = 'Imports the views and builds the regexes, wrapper chains and matchers of every pattern, and reports the patterns that are misconfigured.'
+    
+    option_list = BaseCommand.option_list + (
+        make_option('--urlconf', help='The urlconf module to warm up (ROOT_URLCONF by default)'),
+    )
+    
+    def handle(self, *args, **options):
+        count, problems = warm_up(options.get('urlconf'))
+        
+        for description, error in problems:
+            self.stderr.write('%s: %s\n' % (description, error))
+        if problems:
+            raise CommandError('%d of %d patterns are misconfigured' % (len(problems), count))
+        
+        if int(options.get('verbosity', 1)) >= 1:
+            self.stdout.write('Warmed up %d patterns\n' % count)
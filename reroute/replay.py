@@ -0,0 +1,291 @@
+# Copyright (c) 2010 Mark Sandstrom
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''Replays the requests of access logs through a urlconf and reports what resolving them costs,
+pattern by pattern: how many patterns (and include prefixes) were tried before the match, how long
+resolve took, how many requests matched no pattern, and which verb_url groups can't be reached.
+
+Logs are read a line at a time and only aggregates are kept, so memory doesn't grow with the size
+of the logs. Lines are matched with LOG_REQUEST, which finds the request line ("GET /path
+HTTP/1.1") of the common and combined log formats.
+
+Example:
+    python manage.py reroute_replay access.log.1 access.log.2 --jobs=2
+'''
+
+import re
+import sys
+from multiprocessing import Pool
+from timeit import default_timer as timer
+from urllib import unquote
+
+from django.core.urlresolvers import RegexURLResolver, Resolver404, get_resolver
+
+from resolvers import AdaptiveMatcher, Alternation, CompiledMatcher, IndexedMatcher, ReroutePatternGroup
+
+__all__ = ['Replay', 'replay_files']
+
+LOG_REQUEST = re.compile(r'"(?P<method>[A-Z]+) (?P<path>\S+) HTTP/[\d.]+"')
+
+# The number of distinct unmatched paths that are counted separately; the others are only counted
+# in the total
+MAX_UNMATCHED_PATHS = 1000
+
+def describe(pattern):
+    regex = pattern.regex.pattern
+    name = getattr(pattern, 'name', None)
+    if name:
+        regex = '%s [%s]' % (regex, name)
+    table = getattr(pattern, 'method_table', None)
+    if table is not None:
+        regex = '%s (%s)' % (regex, ', '.join(sorted(table)))
+    return regex
+
+def candidates(resolver, path):
+    '''Returns the patterns (and includes, and alternations of merged patterns) resolver tries
+    for path, in order.'''
+    
+    if isinstance(resolver, ReroutePatternGroup):
+        matcher = resolver.matcher
+        if isinstance(matcher, CompiledMatcher):
+            return matcher.segments
+        if isinstance(matcher, IndexedMatcher):
+            return matcher.candidates(path)
+        if isinstance(matcher, AdaptiveMatcher):
+            return matcher.order
+        return matcher.patterns
+    return [pattern for pattern in resolver.url_patterns if not getattr(pattern, 'reverse_only', False)]
+
+def allowed(pattern, method):
+    table = getattr(pattern, 'method_table', None)
+    if table is None:
+        return True
+    return method in table or method == 'OPTIONS' or (method == 'HEAD' and 'GET' in table)
+
+class Replay(object):
+    '''Aggregates the routing cost of requests resolved by resolver.
+    
+    stats maps the key of each pattern (its position in the urlconf) to a list of:
+        hits: the number of requests it matched
+        tried: the total number of patterns and include prefixes tried for them
+        seconds: the total time resolve took for them
+        not_allowed: the number of them whose method it doesn't accept (verb_url groups)
+    '''
+    
+    def __init__(self, resolver):
+        self.resolver = resolver
+        self.requests = 0
+        self.skipped = 0
+        self.unmatched = 0
+        self.unmatched_seconds = 0.0
+        self.unmatched_paths = {}
+        self.stats = {}
+        
+        # The key and description of every pattern, and the verb_url groups that an earlier
+        # pattern with the same regex shadows
+        self.keys = {}
+        self.labels = {}
+        self.shadowed = []
+        self._index(resolver, (), '')
+    
+    def _index(self, resolver, key, prefix):
+        regexes = {}
+        items = []
+        for position, pattern in enumerate(resolver.url_patterns):
+            if isinstance(pattern, ReroutePatternGroup):
+                # The group's patterns compete with the patterns around it
+                items.extend((key + (position, member_position), member) for member_position, member in enumerate(pattern.url_patterns))
+            else:
+                items.append((key + (position,), pattern))
+        
+        for pattern_key, pattern in items:
+            if getattr(pattern, 'reverse_only', False):
+                continue
+            if isinstance(pattern, RegexURLResolver):
+                self._index(pattern, pattern_key, prefix + pattern.regex.pattern + ' ')
+            else:
+                self._add(pattern, pattern_key, prefix, regexes)
+    
+    def _add(self, pattern, key, prefix, regexes):
+        self.keys[id(pattern)] = key
+        self.labels[key] = prefix + describe(pattern)
+        
+        regex = pattern.regex.pattern
+        earlier = regexes.setdefault(regex, key)
+        if earlier != key and hasattr(pattern, 'method_table'):
+            self.shadowed.append((key, earlier))
+    
+    def match(self, resolver, path, tried):
+        '''Returns the pattern path resolves to (or None) and the number of patterns and include
+        prefixes tried, the same way resolver.resolve would try them.'''
+        
+        match = resolver.regex.search(path)
+        if not match:
+            return None, tried
+        path = path[match.end():]
+        
+        for candidate in candidates(resolver, path):
+            if isinstance(candidate, RegexURLResolver):
+                if not isinstance(candidate, ReroutePatternGroup):
+                    tried += 1
+                pattern, tried = self.match(candidate, path, tried)
+                if pattern is not None:
+                    return pattern, tried
+                continue
+            
+            tried += 1
+            try:
+                match = candidate.resolve(path)
+            except Resolver404:
+                match = None
+            if match:
+                # Alternations of merged patterns (see CompiledMatcher) resolve to the callback of
+                # the pattern that matched
+                if isinstance(candidate, Alternation):
+                    candidate = match[0].pattern
+                return candidate, tried
+        return None, tried
+    
+    def replay(self, method, path):
+        self.requests += 1
+        
+        start = timer()
+        try:
+            self.resolver.resolve(path)
+        except Resolver404:
+            pass
+        elapsed = timer() - start
+        
+        pattern, tried = self.match(self.resolver, path, 0)
+        if pattern is None:
+            self.unmatched += 1
+            self.unmatched_seconds += elapsed
+            if path in self.unmatched_paths or len(self.unmatched_paths) < MAX_UNMATCHED_PATHS:
+                self.unmatched_paths[path] = self.unmatched_paths.get(path, 0) + 1
+            return
+        
+        key = self.keys[id(pattern)]
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = [0, 0, 0.0, 0]
+        stats[0] += 1
+        stats[1] += tried
+        stats[2] += elapsed
+        if not allowed(pattern, method):
+            stats[3] += 1
+    
+    def replay_log(self, lines):
+        for line in lines:
+            request = LOG_REQUEST.search(line)
+            if request is None:
+                self.skipped += 1
+                continue
+            
+            path = request.group('path')
+            # Absolute URIs and query strings aren't part of the path Django resolves
+            if not path.startswith('/'):
+                path = '/' + path.partition('://')[2].partition('/')[2]
+            path = unquote(path.partition('?')[0]).decode('utf-8', 'replace')
+            self.replay(request.group('method'), path)
+    
+    def state(self):
+        return {
+            'requests': self.requests,
+            'skipped': self.skipped,
+            'unmatched': self.unmatched,
+            'unmatched_seconds': self.unmatched_seconds,
+            'unmatched_paths': self.unmatched_paths,
+            'stats': self.stats,
+        }
+    
+    def merge(self, state):
+        '''Adds the aggregates of another Replay's state() to this one.'''
+        
+        self.requests += state['requests']
+        self.skipped += state['skipped']
+        self.unmatched += state['unmatched']
+        self.unmatched_seconds += state['unmatched_seconds']
+        for path, count in state['unmatched_paths'].iteritems():
+            if path in self.unmatched_paths or len(self.unmatched_paths) < MAX_UNMATCHED_PATHS:
+                self.unmatched_paths[path] = self.unmatched_paths.get(path, 0) + count
+        for key, values in state['stats'].iteritems():
+            stats = self.stats.setdefault(key, [0, 0, 0.0, 0])
+            for index, value in enumerate(values):
+                stats[index] += value
+    
+    def report(self, output, limit=50):
+        '''Writes the patterns that cost the most (the most patterns tried in total) first, then
+        the unmatched paths, the shadowed verb_url groups and the patterns no request matched.'''
+        
+        write = output.write
+        write('%d requests, %d unmatched, %d log lines skipped\n\n' % (self.requests, self.unmatched, self.skipped))
+        
+        write('%8s %8s %10s %6s  %s\n' % ('hits', 'tried', 'resolve', '405', 'pattern'))
+        rows = sorted(self.stats.iteritems(), key=lambda (key, stats): (-stats[1], key))
+        for key, (hits, tried, seconds, not_allowed) in rows[:limit]:
+            write('%8d %8.1f %8.1fus %6d  %s\n' % (hits, float(tried) / hits, seconds / hits * 1e6, not_allowed, self.labels[key]))
+        if self.unmatched:
+            write('%8d %8s %8.1fus %6s  (unmatched)\n' % (self.unmatched, '', self.unmatched_seconds / self.unmatched * 1e6, ''))
+        
+        if self.unmatched_paths:
+            write('\nUnmatched paths:\n')
+            for path, count in sorted(self.unmatched_paths.iteritems(), key=lambda (path, count): (-count, path))[:limit]:
+                write('%8d  %s\n' % (count, path.encode('utf-8')))
+        
+        if self.shadowed:
+            write('\nverb_url groups shadowed by an earlier pattern with the same regex:\n')
+            for key, earlier in self.shadowed:
+                write('  %s (shadowed by %s)\n' % (self.labels[key], self.labels[earlier]))
+        
+        unused = sorted(key for key in self.keys.itervalues() if key not in self.stats)
+        if unused:
+            write('\nPatterns no request matched (%d):\n' % len(unused))
+            for key in unused[:limit]:
+                write('  %s\n' % self.labels[key])
+
+def replay_file(arguments):
+    urlconf, filename = arguments
+    replay = Replay(get_resolver(urlconf))
+    if filename == '-':
+        replay.replay_log(sys.stdin)
+    else:
+        with open(filename) as lines:
+            replay.replay_log(lines)
+    return replay.state()
+
+def replay_files(filenames, urlconf=None, jobs=1):
+    '''Replays the logs named by filenames ('-' is stdin) through urlconf (the ROOT_URLCONF by
+    default) and returns the Replay. With jobs > 1, the logs are replayed by that many processes
+    in parallel (urlconf must be the name of a module).'''
+    
+    replay = Replay(get_resolver(urlconf))
+    arguments = [(urlconf, filename) for filename in filenames]
+    if jobs > 1 and len(filenames) > 1:
+        pool = Pool(jobs)
+        try:
+            for state in pool.imap_unordered(replay_file, arguments):
+                replay.merge(state)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for argument in arguments:
+            replay.merge(replay_file(argument))
+    return replay
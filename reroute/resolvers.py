@@ -0,0 +1,576 @@
+# Copyright (c) 2010 Mark Sandstrom
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import heapq
+import re
+import threading
+from collections import OrderedDict
+from timeit import default_timer as timer
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.urlresolvers import RegexURLResolver, Resolver404
+from django.utils.translation import get_language
+
+import instrumentation
+
+# Django 1.3 compatibility
+try:
+    from django.core.urlresolvers import ResolverMatch
+except ImportError:
+    ResolverMatch = None
+
+__all__ = ['ReroutePatternGroup', 'SequentialMatcher', 'CompiledMatcher', 'IndexedMatcher', 'AdaptiveMatcher', 'PrefixIndex', 'ResolveCache']
+
+# Python 2's re module refuses to compile regexes with more than 99 capturing groups
+MAX_GROUPS = 99
+
+REGEX_METACHARACTERS = '.^$*+?{}[]|()\\'
+REGEX_QUANTIFIERS = '*+?{'
+
+def mergeable_source(pattern):
+    '''Returns the source of pattern's regex rewritten so that it can be one branch of a larger
+    alternation, or None if the pattern has to be matched on its own.
+    
+    A pattern can be merged if it's a reroute pattern (it has resolver_match), its regex is a
+    plain string anchored with ^, and the regex doesn't use top-level alternation, inline flags,
+    backreferences or conditionals (which all change meaning when groups are renumbered or the
+    regex is embedded in another one), and it isn't a byte string with non-ASCII characters. Named
+    groups are turned into plain groups; the matchers map them back to names using the pattern's
+    own regex.
+    '''
+    
+    if not hasattr(pattern, 'resolver_match'):
+        return None
+    
+    # Translated (lazy) regexes depend on the active language
+    if not isinstance(getattr(pattern, '_regex', ''), basestring):
+        return None
+    
+    source = pattern.regex.pattern
+    if not source.startswith('^'):
+        return None
+    
+    # Non-ASCII byte strings can't be joined with unicode sources
+    if isinstance(source, str):
+        try:
+            source.decode('ascii')
+        except UnicodeDecodeError:
+            return None
+    
+    merged = []
+    depth = 0
+    i = 0
+    
+    while i < len(source):
+        char = source[i]
+        
+        if char == '\\':
+            escaped = source[i + 1:i + 2]
+            if escaped.isdigit() and escaped != '0':
+                return None
+            merged.append(source[i:i + 2])
+            i += 2
+            continue
+        
+        if char == '[':
+            # Copy the character class verbatim. A ] directly after [ or [^ is a literal.
+            end = i + 1
+            if source[end:end + 1] == '^':
+                end += 1
+            if source[end:end + 1] == ']':
+                end += 1
+            while end < len(source) and source[end] != ']':
+                end += 2 if source[end] == '\\' else 1
+            merged.append(source[i:end + 1])
+            i = end + 1
+            continue
+        
+        if char == '(':
+            if source.startswith('(?P<', i):
+                merged.append('(')
+                i = source.index('>', i) + 1
+                depth += 1
+                continue
+            if source.startswith('(?P=', i) or source.startswith('(?(', i):
+                return None
+            if source.startswith('(?', i) and source[i + 2:i + 3] in 'iLmsux':
+                return None
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == '|' and depth == 0:
+            return None
+        
+        merged.append(char)
+        i += 1
+    
+    return ''.join(merged)
+
+def has_top_level_alternation(source):
+    '''Returns True if source contains a | outside of any group or character class.'''
+    
+    depth = 0
+    i = 0
+    while i < len(source):
+        char = source[i]
+        if char == '\\':
+            i += 1
+        elif char == '[':
+            i += 1
+            if source[i:i + 1] == '^':
+                i += 1
+            if source[i:i + 1] == ']':
+                i += 1
+            while i < len(source) and source[i] != ']':
+                i += 2 if source[i] == '\\' else 1
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == '|' and depth == 0:
+            return True
+        i += 1
+    return False
+
+def literal_prefix(pattern):
+    '''Returns the literal text every path matched by pattern's regex must start with ('' if
+    there isn't any, or if it can't be determined safely).'''
+    
+    # Translated (lazy) regexes depend on the active language
+    if not isinstance(getattr(pattern, '_regex', ''), basestring):
+        return ''
+    
+    regex = pattern.regex
+    source = regex.pattern
+    if not source.startswith('^') or regex.flags & (re.IGNORECASE | re.MULTILINE | re.VERBOSE):
+        return ''
+    if has_top_level_alternation(source):
+        return ''
+    
+    prefix = []
+    i = 1
+    while i < len(source):
+        char = source[i]
+        if char == '\\':
+            # Escaped punctuation is literal; escapes like \d, \b or \1 aren't
+            char = source[i + 1:i + 2]
+            if not char or char.isalnum():
+                break
+            i += 2
+        elif char in REGEX_METACHARACTERS:
+            break
+        else:
+            i += 1
+        
+        # Non-ASCII characters may be compared as bytes or as unicode depending on the path
+        if ord(char) > 127:
+            break
+        
+        # A quantified character is optional (or repeated), so the prefix ends before it
+        if source[i:i + 1] and source[i] in REGEX_QUANTIFIERS:
+            break
+        
+        prefix.append(char)
+    
+    return ''.join(prefix)
+
+class PrefixIndex(object):
+    '''A trie of the literal prefixes (see literal_prefix) of a list of patterns. A pattern can
+    only match a path that starts with its literal prefix, so candidates(path) is the (usually
+    much shorter) list of patterns worth trying, in declaration order.'''
+    
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self.prefixes = [literal_prefix(pattern) for pattern in self.patterns]
+        
+        # Each node maps characters to child nodes; the '' key holds the indexes of the patterns
+        # whose prefix ends at the node.
+        self.root = {}
+        for index, prefix in enumerate(self.prefixes):
+            node = self.root
+            for char in prefix:
+                node = node.setdefault(char, {})
+            node.setdefault('', []).append(index)
+            
+    def candidate_indexes(self, path):
+        node = self.root
+        indexes = list(node.get('', ()))
+        for char in path:
+            node = node.get(char)
+            if node is None:
+                break
+            indexes.extend(node.get('', ()))
+        indexes.sort()
+        return indexes
+        
+    def candidates(self, path):
+        patterns = self.patterns
+        return [patterns[index] for index in self.candidate_indexes(path)]
+
+class SequentialMatcher(object):
+    '''Tries each pattern of a group in declaration order, just like Django's resolver.'''
+    
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        
+    def resolve(self, path):
+        for pattern in self.patterns:
+            try:
+                match = pattern.resolve(path)
+            except Resolver404:
+                continue
+            if match:
+                return match
+        return None
+
+class Alternation(object):
+    '''Matches a run of mergeable patterns with a single regex. Every branch of the alternation is
+    wrapped in a capturing group (the branch's tag), so the matching pattern is identified by
+    match.lastindex and its captured arguments are the groups that follow the tag.'''
+    
+    def __init__(self, patterns, sources):
+        self.patterns = patterns
+        self.regex = re.compile('|'.join('(%s)' % source for source in sources), re.UNICODE)
+        self.branches = {}
+        
+        tag = 1
+        for pattern in patterns:
+            regex = pattern.regex
+            self.branches[tag] = (pattern, tag, regex.groups, regex.groupindex)
+            tag += regex.groups + 1
+            
+    def resolve(self, path):
+        # Every branch is anchored with ^, so match is equivalent to search here
+        match = self.regex.match(path)
+        if match:
+            pattern, tag, groups, groupindex = self.branches[match.lastindex]
+            # Same rules as RegexURLPattern.resolve: named groups become kwargs, otherwise all
+            # groups become positional arguments.
+            if groupindex:
+                kwargs = dict((name, match.group(tag + index)) for name, index in groupindex.iteritems())
+                args = ()
+            else:
+                kwargs = {}
+                args = match.groups()[tag:tag + groups]
+            return pattern.resolver_match(args, kwargs)
+        return None
+        
+class CompiledMatcher(SequentialMatcher):
+    '''Merges consecutive mergeable patterns (see mergeable_source) into alternations so that a
+    single regex search finds the first matching pattern of the run. Patterns that can't be
+    merged are matched on their own, in order, between the alternations.'''
+    
+    def __init__(self, patterns):
+        super(CompiledMatcher, self).__init__(patterns)
+        
+        self.segments = []
+        run = []
+        for pattern in self.patterns:
+            source = mergeable_source(pattern)
+            if source is None:
+                self._add_run(run)
+                run = []
+                self.segments.append(pattern)
+            else:
+                run.append((pattern, source))
+        self._add_run(run)
+        
+    def _add_run(self, run):
+        chunk = []
+        groups = 0
+        for pattern, source in run:
+            branch_groups = pattern.regex.groups + 1
+            if chunk and groups + branch_groups > MAX_GROUPS:
+                self._add_chunk(chunk)
+                chunk = []
+                groups = 0
+            chunk.append((pattern, source))
+            groups += branch_groups
+        self._add_chunk(chunk)
+        
+    def _add_chunk(self, chunk):
+        if len(chunk) < 2:
+            self.segments.extend(pattern for pattern, source in chunk)
+            return
+        
+        patterns, sources = zip(*chunk)
+        try:
+            self.segments.append(Alternation(patterns, sources))
+        except (re.error, AssertionError, OverflowError, UnicodeError):
+            self.segments.extend(patterns)
+    
+    def resolve(self, path):
+        for segment in self.segments:
+            try:
+                match = segment.resolve(path)
+            except Resolver404:
+                continue
+            if match:
+                return match
+        return None
+
+class IndexedMatcher(SequentialMatcher):
+    '''Only tries the patterns whose literal prefix the path starts with (see PrefixIndex), in
+    declaration order. Patterns without a literal prefix are tried for every path.'''
+    
+    def __init__(self, patterns):
+        super(IndexedMatcher, self).__init__(patterns)
+        self.index = PrefixIndex(self.patterns)
+        
+    def candidates(self, path):
+        return self.index.candidates(path)
+        
+    def resolve(self, path):
+        for pattern in self.index.candidates(path):
+            try:
+                match = pattern.resolve(path)
+            except Resolver404:
+                continue
+            if match:
+                return match
+        return None
+
+class AdaptiveMatcher(SequentialMatcher):
+    '''Tries the patterns in order of popularity, as far as that can't change the result.
+    
+    Two patterns can only match the same path if the literal prefix (see literal_prefix) of one
+    starts with the literal prefix of the other. Patterns that overlap this way keep their
+    declaration order; the others are moved so that the patterns that matched the most paths so
+    far are tried first. The order is recomputed every REORDER_EVERY resolves.
+    '''
+    
+    REORDER_EVERY = 1000
+    
+    def __init__(self, patterns):
+        super(AdaptiveMatcher, self).__init__(patterns)
+        self.index = PrefixIndex(self.patterns)
+        self.hits = [0] * len(self.patterns)
+        self.resolves = 0
+        
+        # The patterns that must stay ahead of each pattern, and behind it
+        self.predecessors = [[] for pattern in self.patterns]
+        self.successors = [[] for pattern in self.patterns]
+        for index, prefix in enumerate(self.index.prefixes):
+            for other in self._overlapping(prefix):
+                if other < index:
+                    self.predecessors[index].append(other)
+                    self.successors[other].append(index)
+        
+        self._order = list(enumerate(self.patterns))
+        
+    def _overlapping(self, prefix):
+        '''Returns the indexes of the patterns whose prefix starts with prefix or is a prefix of
+        it (including the patterns with the same prefix).'''
+        
+        node = self.index.root
+        indexes = list(node.get('', ()))
+        for char in prefix:
+            node = node[char]
+            indexes.extend(node.get('', ()))
+        
+        # Every pattern below the node of prefix extends it
+        nodes = [child for char, child in node.iteritems() if char]
+        while nodes:
+            node = nodes.pop()
+            indexes.extend(node.get('', ()))
+            nodes.extend(child for char, child in node.iteritems() if char)
+        return indexes
+    
+    @property
+    def order(self):
+        '''The patterns in the order they're currently tried.'''
+        
+        return [pattern for index, pattern in self._order]
+        
+    def counters(self):
+        '''Returns (pattern, hits) tuples in declaration order.'''
+        
+        return zip(self.patterns, self.hits)
+        
+    def reorder(self):
+        # A topological sort of the patterns (ordered by their predecessors) that picks the
+        # pattern with the most hits whenever there's a choice
+        hits = self.hits
+        waiting = [len(predecessors) for predecessors in self.predecessors]
+        ready = [(-hits[index], index) for index, count in enumerate(waiting) if not count]
+        heapq.heapify(ready)
+        
+        order = []
+        while ready:
+            index = heapq.heappop(ready)[1]
+            order.append((index, self.patterns[index]))
+            for successor in self.successors[index]:
+                waiting[successor] -= 1
+                if not waiting[successor]:
+                    heapq.heappush(ready, (-hits[successor], successor))
+        
+        self._order = order
+        
+    def resolve(self, path):
+        self.resolves += 1
+        if not self.resolves % self.REORDER_EVERY:
+            self.reorder()
+        
+        for index, pattern in self._order:
+            try:
+                match = pattern.resolve(path)
+            except Resolver404:
+                continue
+            if match:
+                self.hits[index] += 1
+                return match
+        return None
+
+class ResolveCache(object):
+    '''A thread-safe LRU cache with hit and miss counters. Used by ReroutePatternGroup to cache
+    resolve results by path.'''
+    
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        
+    def __len__(self):
+        return len(self._entries)
+        
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            # Reinsert the entry to mark it as the most recently used
+            self._entries[key] = value
+            self.hits += 1
+            return value
+            
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+def copy_match(match):
+    '''Returns a copy of a resolve result with its own kwargs dict.'''
+    
+    # Django 1.3 compatibility
+    if ResolverMatch:
+        return ResolverMatch(match.func, match.args, dict(match.kwargs), match.url_name, match.app_name, match.namespaces)
+    else:
+        func, args, kwargs = match
+        return func, args, dict(kwargs)
+
+class ReroutePatternGroup(RegexURLResolver):
+    '''The patterns of a reroute_patterns group, resolved as a whole by a matcher.
+    
+    The group is a resolver with an empty prefix, so reverse() and includes work as if the
+    patterns had been listed directly in the urlconf, and resolve returns the same ResolverMatch
+    as the matching pattern would have on its own.
+    '''
+    
+    matchers = {
+        'sequential': SequentialMatcher,
+        'compiled': CompiledMatcher,
+        'indexed': IndexedMatcher,
+        'adaptive': AdaptiveMatcher,
+    }
+    
+    # Returned by the cache for paths that haven't been resolved yet
+    NOT_CACHED = object()
+    
+    def __init__(self, pattern_list, matcher='sequential', cache_size=None):
+        super(ReroutePatternGroup, self).__init__(r'^', pattern_list)
+        
+        if isinstance(matcher, basestring):
+            try:
+                matcher = self.matchers[matcher]
+            except KeyError:
+                raise ImproperlyConfigured('Unknown reroute_patterns matcher %r (choose from %s)' % (matcher, ', '.join(sorted(self.matchers))))
+        
+        self.matcher_class = matcher
+        self._matcher = None
+        self._tried = [[pattern] for pattern in pattern_list]
+        
+        # Caches the result of resolving each path (including misses). Patterns clear the cache
+        # when they're reconfigured.
+        self.cache = ResolveCache(cache_size) if cache_size else None
+        self._localized = any(not isinstance(getattr(pattern, '_regex', ''), basestring) for pattern in pattern_list)
+        for pattern in pattern_list:
+            if hasattr(pattern, 'reroute_group'):
+                pattern.reroute_group = self
+        
+    @property
+    def label(self):
+        return 'group of %d patterns (%s)' % (len(self._tried), self.matcher_class.__name__)
+    
+    def __repr__(self):
+        return '<%s %s (%d patterns)>' % (self.__class__.__name__, self.matcher_class.__name__, len(self._tried))
+    
+    @property
+    def matcher(self):
+        # Built on first use since matchers compile the patterns' regexes. Patterns that are only
+        # kept for reverse() never match, so the matcher doesn't need to try them.
+        if self._matcher is None:
+            self._matcher = self.matcher_class([pattern for pattern in self.url_patterns if not getattr(pattern, 'reverse_only', False)])
+        return self._matcher
+    
+    def clear_cache(self):
+        if self.cache is not None:
+            self.cache.clear()
+    
+    def resolve(self, path):
+        if instrumentation.observers:
+            start = timer()
+            try:
+                return self.match_path(path)
+            finally:
+                # Matchers don't go through the patterns' resolve, so the group is timed as a whole
+                # and reported under its own label
+                instrumentation.emit('resolve', self.label, None, timer() - start)
+        return self.match_path(path)
+    
+    def match_path(self, path):
+        cache = self.cache
+        
+        if cache is None:
+            match = self.matcher.resolve(path)
+        else:
+            # Translated regexes match differently depending on the active language
+            key = (get_language(), path) if self._localized else path
+            match = cache.get(key, self.NOT_CACHED)
+            if match is self.NOT_CACHED:
+                match = self.matcher.resolve(path) or None
+                cache.set(key, match)
+            if match:
+                # Views may modify their kwargs, so never hand out the cached dict
+                match = copy_match(match)
+        
+        if not match:
+            raise Resolver404({'tried': self._tried, 'path': path})
+        return match
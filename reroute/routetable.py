@@ -0,0 +1,359 @@
+# Copyright (c) 2010 Mark Sandstrom
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''Saves the configured patterns of a urlconf to a file that worker processes can load instead
+of importing the urlconf modules and running reroute_patterns again.
+
+The file holds every pattern's regex, name, default arguments and view (as a dotted path), the
+wrappers of reroute patterns (as dotted paths; instances as the module attribute that holds them),
+the views and default arguments of each method of verb_url groups, the matcher and cache size of
+pattern groups, and includes with their namespaces. Regexes, matchers and wrapper chains are still compiled and built on first use (or by
+warm_up), as they are for a freshly imported urlconf.
+
+The file also holds a fingerprint of the urlconf's source: the contents of every module that an
+import statement (or include) asks for while the urlconf is imported and its includes are
+followed, and the Python, Django and reroute versions. That covers pattern lists imported from
+helper modules and included as lists. load() imports the urlconf as usual when the fingerprint
+doesn't match. Save tables from a process that hasn't imported the project's modules yet (like the
+reroute_routetable command): the imports of modules that were already imported aren't seen,
+except for the urlconf module itself, which save() imports again.
+
+Example:
+    # Once per deployment (or: python manage.py reroute_routetable project.urls routes.table)
+    routetable.save('routes.table', 'project.urls')
+    
+    # project/table_urls.py, the ROOT_URLCONF of the workers
+    from reroute import routetable
+    
+    urlconf = routetable.load('routes.table', 'project.urls')
+    urlpatterns = urlconf.urlpatterns
+    handler404 = urlconf.handler404
+    handler500 = urlconf.handler500
+'''
+
+import __builtin__
+import hashlib
+import marshal
+import os
+import sys
+from types import ModuleType
+
+import django
+from django.conf import urls as django_urls
+from django.core.exceptions import ImproperlyConfigured
+from django.core.urlresolvers import RegexURLPattern, RegexURLResolver
+from django.utils.importlib import import_module
+
+from base import PatternsId, RerouteRegexURLPattern, ReversePattern
+from resolvers import ReroutePatternGroup
+from verbs import VerbRegexURLPattern
+
+__all__ = ['save', 'load', 'RouteTable']
+
+# Changed whenever the layout of the file changes
+FORMAT = 'reroute route table 2'
+
+# Packages that the versions of the fingerprint already cover
+VERSIONED_PACKAGES = ('django', 'reroute')
+
+HANDLERS = ('handler404', 'handler500')
+
+class RouteTable(object):
+    '''A urlconf returned by load. loaded is False if the urlconf was imported rather than
+    loaded from the route table.'''
+    
+    def __init__(self, urlpatterns, handlers, loaded):
+        self.urlpatterns = urlpatterns
+        self.loaded = loaded
+        for name in HANDLERS:
+            setattr(self, name, handlers[name])
+
+def versions():
+    import reroute
+    return (FORMAT, sys.version, django.get_version(), reroute.__version__)
+
+def source_file(module):
+    filename = getattr(module, '__file__', None)
+    if filename is None:
+        raise ImproperlyConfigured("The urlconf module %s can't be saved to a route table since it has no source file" % module.__name__)
+    if filename.endswith(('.pyc', '.pyo')) and os.path.exists(filename[:-1]):
+        filename = filename[:-1]
+    return os.path.abspath(filename)
+
+def file_digest(filename):
+    with open(filename, 'rb') as source:
+        return hashlib.sha1(source.read()).hexdigest()
+
+class ImportRecorder(object):
+    '''While installed (as a context manager), adds the (name, filename) of every module that
+    import statements and import_module ask for to modules, whether or not it was imported
+    before. Installs a process-wide __import__ hook.'''
+    
+    def __init__(self, modules):
+        self.modules = modules
+        
+    def __enter__(self):
+        self.original = __builtin__.__import__
+        __builtin__.__import__ = self.import_hook
+        return self
+        
+    def __exit__(self, *exc_info):
+        __builtin__.__import__ = self.original
+        
+    def import_hook(self, name, globals=None, locals=None, fromlist=None, level=-1):
+        module = self.original(name, globals, locals, fromlist, level)
+        
+        # Without a fromlist, "import a.b" returns a
+        imported = module
+        if not fromlist:
+            for part in name.split('.')[1:]:
+                imported = getattr(imported, part, None)
+        self.add(imported)
+        for item in fromlist or ():
+            self.add(getattr(module, item, None))
+        return module
+        
+    def add(self, module):
+        if not isinstance(module, ModuleType) or module.__name__.split('.')[0] in VERSIONED_PACKAGES:
+            return
+        # Builtin and extension modules
+        if not (getattr(module, '__file__', None) or '').endswith(('.py', '.pyc', '.pyo')):
+            return
+        self.modules.add((module.__name__, source_file(module)))
+
+def import_object(path):
+    module_name, _, name = path.rpartition('.')
+    return getattr(import_module(module_name), name)
+
+def module_attribute_path(obj, modules):
+    for module_name in sorted(name for name, filename in modules):
+        module = sys.modules.get(module_name)
+        if module is None:
+            continue
+        attributes = vars(module)
+        for name in sorted(attributes):
+            if attributes[name] is obj:
+                return '%s.%s' % (module_name, name)
+    return None
+
+def dotted_path(obj, description, modules=(), found=None):
+    '''Returns the dotted path obj can be imported from: its module and name, or else the
+    attribute that holds it in one of modules, the (name, filename) of the modules the urlconf
+    imports (like a ResponseCache instance made in the urlconf). found caches the paths of objects
+    found that way, by id. Raises ImproperlyConfigured if there isn't one (like for closures and
+    partials).'''
+    
+    module_name = getattr(obj, '__module__', None)
+    name = getattr(obj, '__name__', None)
+    if module_name and name:
+        path = '%s.%s' % (module_name, name)
+        try:
+            if import_object(path) is obj:
+                return path
+        except (ImportError, AttributeError):
+            pass
+    
+    if found is None:
+        found = {}
+    path = found.get(id(obj))
+    if path is None:
+        path = module_attribute_path(obj, modules)
+    if path is not None:
+        found[id(obj)] = path
+        return path
+    raise ImproperlyConfigured("%s %r can't be saved to a route table since it can't be imported by name" % (description, obj))
+
+def regex_source(pattern):
+    regex = pattern._regex
+    if not isinstance(regex, basestring):
+        raise ImproperlyConfigured("The translated regex of %r can't be saved to a route table" % pattern)
+    return regex
+
+def view_path(pattern, modules, found):
+    # Interned so marshal writes each distinct path once
+    return intern(str(getattr(pattern, '_callback_str', None) or dotted_path(pattern.callback, 'The view', modules, found)))
+
+def wrapper_paths(pattern, modules, found):
+    return [intern(dotted_path(wrapper, 'The wrapper', modules, found)) for wrapper in pattern.wrappers]
+
+def arguments(default_args):
+    # marshal only writes plain dicts (not the shared NO_ARGS)
+    return dict(default_args)
+
+def dump_patterns(url_patterns, modules, found):
+    '''Returns the entries describing url_patterns. Adds the (name, filename) of every module
+    imported by the urlconf modules that are included by name to modules. found is passed on to
+    dotted_path.'''
+    
+    entries = []
+    for pattern in url_patterns:
+        kind = type(pattern)
+        
+        if kind is ReroutePatternGroup:
+            matcher = pattern.matcher_class
+            for name, matcher_class in ReroutePatternGroup.matchers.iteritems():
+                if matcher_class is matcher:
+                    matcher = name
+                    break
+            else:
+                matcher = dotted_path(matcher, 'The matcher', modules, found)
+            cache_size = pattern.cache.max_size if pattern.cache is not None else None
+            entries.append(('group', matcher, cache_size, dump_patterns(pattern.url_patterns, modules, found)))
+        elif kind is RegexURLResolver:
+            if not isinstance(pattern.urlconf_name, list):
+                with ImportRecorder(modules):
+                    module = pattern.urlconf_module
+                modules.add((module.__name__, source_file(module)))
+            entries.append(('include', regex_source(pattern), pattern.default_kwargs, pattern.app_name,
+                pattern.namespace, dump_patterns(pattern.url_patterns, modules, found)))
+        elif kind is VerbRegexURLPattern:
+            # The pattern's own method first, so it's the one that's kept when the group is
+            # configured again
+            methods = [(pattern.method, view_path(pattern, modules, found), arguments(pattern.method_callbacks[pattern.method].default_args))]
+            for method, record in sorted(pattern.method_callbacks.iteritems()):
+                if method != pattern.method:
+                    methods.append((method, intern(dotted_path(record.callback, 'The view', modules, found)), arguments(record.default_args)))
+            entries.append(('verb', regex_source(pattern), pattern.name, wrapper_paths(pattern, modules, found), methods))
+        elif kind is RerouteRegexURLPattern:
+            entries.append(('reroute', regex_source(pattern), view_path(pattern, modules, found), arguments(pattern.default_args),
+                pattern.name, wrapper_paths(pattern, modules, found)))
+        elif kind is ReversePattern:
+            entries.append(('reverse', regex_source(pattern), view_path(pattern, modules, found), arguments(pattern.default_args), pattern.name))
+        elif kind is RegexURLPattern:
+            entries.append(('pattern', regex_source(pattern), view_path(pattern, modules, found), arguments(pattern.default_args), pattern.name))
+        else:
+            raise ImproperlyConfigured("%r can't be saved to a route table (unsupported pattern class %s)" % (pattern, kind.__name__))
+    return entries
+
+def load_patterns(entries):
+    '''Returns the patterns described by entries (see dump_patterns), configured as they were
+    when they were dumped.'''
+    
+    url_patterns = []
+    for entry in entries:
+        kind = entry[0]
+        
+        if kind == 'group':
+            matcher, cache_size, children = entry[1:]
+            if matcher not in ReroutePatternGroup.matchers:
+                matcher = import_object(matcher)
+            pattern = ReroutePatternGroup(load_patterns(children), matcher=matcher, cache_size=cache_size)
+        elif kind == 'include':
+            regex, default_kwargs, app_name, namespace, children = entry[1:]
+            pattern = RegexURLResolver(regex, load_patterns(children), default_kwargs, app_name, namespace)
+        elif kind == 'verb':
+            regex, name, wrappers, methods = entry[1:]
+            wrappers = [import_object(wrapper) for wrapper in wrappers]
+            # The other patterns of the group are only needed to register their methods; the
+            # reverse entries that follow stand in for them
+            patterns_id = PatternsId()
+            pattern = None
+            for method, view, default_args in methods:
+                member = VerbRegexURLPattern(method, regex, view, default_args, name)
+                member.reroute_config(wrappers, patterns_id)
+                pattern = pattern or member
+        elif kind == 'reroute':
+            regex, view, default_args, name, wrappers = entry[1:]
+            pattern = RerouteRegexURLPattern(regex, view, default_args, name)
+            pattern.reroute_config([import_object(wrapper) for wrapper in wrappers], PatternsId())
+        elif kind == 'reverse':
+            pattern = ReversePattern(RegexURLPattern(*entry[1:]))
+        elif kind == 'pattern':
+            pattern = RegexURLPattern(*entry[1:])
+        else:
+            raise ValueError('Unknown route table entry %r' % kind)
+        url_patterns.append(pattern)
+    return url_patterns
+
+def dumps(urlconf):
+    '''Returns the route table of the urlconf module named urlconf as a string.'''
+    
+    # Imports the urlconf again if needed, so the modules it imports are recorded
+    modules = set()
+    preloaded = sys.modules.pop(urlconf, None)
+    try:
+        with ImportRecorder(modules):
+            module = import_module(urlconf)
+        modules.add((module.__name__, source_file(module)))
+        found = {}
+        entries = dump_patterns(module.urlpatterns, modules, found)
+        
+        handlers = {}
+        for name in HANDLERS:
+            handler = getattr(module, name, getattr(django_urls, name))
+            handlers[name] = handler if isinstance(handler, basestring) else dotted_path(handler, 'The handler', modules, found)
+    finally:
+        if preloaded is not None:
+            sys.modules[urlconf] = preloaded
+            package, _, name = urlconf.rpartition('.')
+            if package in sys.modules:
+                setattr(sys.modules[package], name, preloaded)
+    
+    sources = sorted((name, filename, file_digest(filename)) for name, filename in modules)
+    try:
+        return marshal.dumps((versions(), sources, handlers, entries))
+    except ValueError:
+        raise ImproperlyConfigured("The urlconf %s can't be saved to a route table since the default arguments of its patterns can only hold strings, numbers, None, lists, tuples and dicts" % urlconf)
+
+def save(path, urlconf):
+    '''Saves the route table of the urlconf module named urlconf to the file at path, replacing
+    it atomically. Raises ImproperlyConfigured if the urlconf has patterns that can't be saved
+    (translated regexes, views and wrappers that can't be imported by name, custom pattern
+    classes and default arguments that aren't plain data).'''
+    
+    data = dumps(urlconf)
+    temporary = '%s.%d.tmp' % (path, os.getpid())
+    with open(temporary, 'wb') as table:
+        table.write(data)
+    os.rename(temporary, path)
+
+def loads(data):
+    '''Returns the (urlpatterns, handlers) of a route table string, or None if its fingerprint
+    doesn't match the current source.'''
+    
+    table_versions, sources, handlers, entries = marshal.loads(data)
+    if table_versions != versions():
+        return None
+    for name, filename, digest in sources:
+        try:
+            if file_digest(filename) != digest:
+                return None
+        except IOError:
+            return None
+    return load_patterns(entries), handlers
+
+def load(path, urlconf):
+    '''Returns a RouteTable with the patterns and handlers saved to path, or those of the
+    urlconf module named urlconf if the file can't be read or the urlconf changed since it was
+    saved.'''
+    
+    try:
+        with open(path, 'rb') as table:
+            loaded = loads(table.read())
+    except (IOError, EOFError, ValueError, TypeError, ImportError, AttributeError):
+        loaded = None
+    
+    if loaded is not None:
+        urlpatterns, handlers = loaded
+        return RouteTable(urlpatterns, handlers, True)
+    
+    module = import_module(urlconf)
+    handlers = dict((name, getattr(module, name, getattr(django_urls, name))) for name in HANDLERS)
+    return RouteTable(module.urlpatterns, handlers, False)
@@ -18,9 +18,69 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+import re
 from functools import partial
+from weakref import WeakValueDictionary
 
 def rollup(function, wrappers):            
     for wrapper in reversed(wrappers):
         function = partial(wrapper, function)
-    return function
\ No newline at end of file
+    return function
+
+class EmptyArgs(dict):
+    '''An empty dict that can't be changed. Patterns without default arguments all share NO_ARGS
+    rather than each holding an empty dict of its own.'''
+    
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("Shared default arguments can't be changed")
+    
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _read_only
+    
+    def __reduce__(self):
+        return (EmptyArgs, ())
+
+NO_ARGS = EmptyArgs()
+
+# Compiled regexes are immutable, so every pattern with the same regex source shares one. Patterns
+# keep their compiled regex; the table only finds it while one of them is alive.
+COMPILED_REGEXES = WeakValueDictionary()
+
+def shared_source(regex):
+    # Interned strings are freed along with the last pattern using them; unicode sources are
+    # shared through their compiled regex instead (see CompactPattern.regex)
+    if type(regex) is str:
+        return intern(regex)
+    return regex
+
+def compiled_regex(source):
+    compiled = COMPILED_REGEXES.get(source)
+    if compiled is None:
+        compiled = COMPILED_REGEXES.setdefault(source, re.compile(source, re.UNICODE))
+    return compiled
+
+class WrapperList(list):
+    '''A list of wrappers that can't be changed, shared by every pattern configured with the same
+    wrapper objects in the same order (see shared_wrappers).'''
+    
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("Shared wrapper lists can't be changed; assign a new list of wrappers instead")
+    
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = __iadd__ = __imul__ = _read_only
+    append = extend = insert = pop = remove = reverse = sort = _read_only
+    
+    def __reduce__(self):
+        return (WrapperList, (list(self),))
+
+# Maps the ids of a sequence of wrappers to the WrapperList of them while a pattern uses it. The
+# list keeps the wrappers, and so their ids, alive.
+SHARED_WRAPPERS = WeakValueDictionary()
+
+def shared_wrappers(wrappers):
+    '''Returns a WrapperList of wrappers that's shared by every pattern configured with the same
+    wrapper objects, in the same order.'''
+    
+    key = tuple(id(wrapper) for wrapper in wrappers)
+    shared = SHARED_WRAPPERS.get(key)
+    if shared is None:
+        shared = SHARED_WRAPPERS.setdefault(key, WrapperList(wrappers))
+    return shared
@@ -18,14 +18,169 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+import re
+from collections import namedtuple
+from cStringIO import StringIO
 from functools import partial
+from urllib import unquote_plus
+from weakref import WeakKeyDictionary
 
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 from django.http import HttpResponse
+from django.http.multipartparser import parse_header
 
+import instrumentation
 from base import RerouteRegexURLPattern, url_with_pattern_class
-from utils import rollup
+from utils import NO_ARGS
 
-__all__ = ['verb_url', 'request_method']
+__all__ = ['verb_url', 'request_method', 'head_only']
+
+# Mechanisms that may override the method of a POST request (see request_method), in the order
+# they're tried. Chosen with the REROUTE_METHOD_OVERRIDE setting.
+DEFAULT_METHOD_OVERRIDE = ('post',)
+
+# How much of a request body the 'body' mechanism reads while looking for _method. Chosen with the
+# REROUTE_METHOD_OVERRIDE_SCAN_LIMIT setting.
+DEFAULT_SCAN_LIMIT = 64 * 1024
+SCAN_CHUNK_SIZE = 8 * 1024
+
+METHOD_FIELD = '_method'
+METHOD_HEADER = 'HTTP_X_HTTP_METHOD_OVERRIDE'
+
+# Returned by body scanners that need more of the body to decide
+MORE = object()
+
+class ReplayStream(object):
+    '''A stream that returns data that was already read from stream, followed by the rest of
+    stream. Lets the start of a request body be inspected without consuming it.'''
+    
+    def __init__(self, data, stream):
+        self.buffer = StringIO(data)
+        self.stream = stream
+        
+    def read(self, size=None):
+        if size is None or size < 0:
+            return self.buffer.read() + self.stream.read()
+        data = self.buffer.read(size)
+        if len(data) < size:
+            data += self.stream.read(size - len(data))
+        return data
+        
+    def readline(self, size=None):
+        if size is None:
+            line = self.buffer.readline()
+        else:
+            line = self.buffer.readline(size)
+        if line.endswith('\n') or (size is not None and len(line) >= size):
+            return line
+        if size is None:
+            return line + self.stream.readline()
+        return line + self.stream.readline(size - len(line))
+
+def find_urlencoded_method(data, complete):
+    '''Returns the value of the first _method field of an urlencoded body (None if there
+    isn't one, or MORE if data isn't the complete body and _method may still follow).'''
+    
+    fields = re.split('[&;]', data)
+    if not complete:
+        # The last field may be cut short
+        fields.pop()
+    for field in fields:
+        name, _, value = field.partition('=')
+        if unquote_plus(name) == METHOD_FIELD:
+            return unquote_plus(value)
+    return None if complete else MORE
+
+def multipart_method_finder(boundary):
+    '''Returns a function like find_urlencoded_method for multipart bodies with the given
+    boundary. File uploads are never scanned: _method is only found if it precedes the first file
+    field.'''
+    
+    delimiter = '--' + boundary
+    
+    def find(data, complete):
+        more = None if complete else MORE
+        position = data.find(delimiter)
+        while position >= 0:
+            headers_start = position + len(delimiter)
+            if data.startswith('--', headers_start):
+                # The closing delimiter
+                return None
+            headers_end = data.find('\r\n\r\n', headers_start)
+            if headers_end < 0:
+                return more
+            headers = data[headers_start:headers_end]
+            if re.search(r';\s*filename\*?=', headers, re.IGNORECASE):
+                return None
+            
+            value_start = headers_end + 4
+            value_end = data.find('\r\n' + delimiter, value_start)
+            if value_end < 0:
+                return more
+            
+            name = re.search(r';\s*name="([^"]*)"', headers, re.IGNORECASE)
+            if name and name.group(1) == METHOD_FIELD:
+                return data[value_start:value_end]
+            position = value_end + 2
+        return more
+    
+    return find
+
+def header_method(request):
+    return request.META.get(METHOD_HEADER)
+
+def post_method(request):
+    return request.POST.get(METHOD_FIELD)
+
+def body_method(request):
+    '''Finds the _method field of a request body without parsing the whole body. Reads at most
+    REROUTE_METHOD_OVERRIDE_SCAN_LIMIT bytes, which are replayed to whoever reads the body
+    next.'''
+    
+    try:
+        return request._reroute_body_method
+    except AttributeError:
+        pass
+    
+    content_type, params = parse_header(request.META.get('CONTENT_TYPE', ''))
+    if content_type == 'application/x-www-form-urlencoded':
+        find = find_urlencoded_method
+    elif content_type == 'multipart/form-data' and params.get('boundary'):
+        find = multipart_method_finder(params['boundary'])
+    else:
+        return None
+    
+    stream = getattr(request, '_stream', None)
+    if hasattr(request, '_post') or stream is None or getattr(request, '_read_started', False):
+        # The body has been parsed, or can't be read without losing it
+        return post_method(request)
+    
+    if hasattr(request, '_body'):
+        method = find(request._body, True)
+    else:
+        limit = getattr(settings, 'REROUTE_METHOD_OVERRIDE_SCAN_LIMIT', DEFAULT_SCAN_LIMIT)
+        data = ''
+        method = None
+        while len(data) < limit:
+            chunk = stream.read(min(SCAN_CHUNK_SIZE, limit - len(data)))
+            data += chunk
+            method = find(data, not chunk)
+            if method is not MORE:
+                break
+        else:
+            # Gave up before the end of the body
+            method = None
+        request._stream = ReplayStream(data, stream)
+    
+    request._reroute_body_method = method
+    return method
+
+METHOD_OVERRIDES = {
+    'header': header_method,
+    'post': post_method,
+    'body': body_method,
+}
 
 def request_method(request):
     '''Returns the effective HTTP method of a request. To support the entire range of HTTP methods
@@ -40,6 +195,12 @@ def request_method(request):
             <button type="submit" name="_method" value="put">Update</button>
         </form>
     
+    The REROUTE_METHOD_OVERRIDE setting lists the mechanisms that are tried, in order:
+        'post': the _method parameter of request.POST (the default). Parses the whole body.
+        'body': the first _method field of an urlencoded or multipart body, found by reading
+            only as much of the body as needed (and no file uploads). The body is left intact.
+        'header': the X-HTTP-Method-Override header.
+    
     Args:
         request: an HttpRequest
     
@@ -53,53 +214,160 @@ def request_method(request):
     # is therefore safe to emulate HTTP methods with less-limited semantics. See
     # http://www.w3.org/Protocols/rfc2616/rfc2616-sec9.html ("Safe and Idempotent Methods")
     # for details.
-
-    if request.method == 'POST' and '_method' in request.POST:
-        method = request.POST['_method'].upper()
-    else:
-        method = request.method
+    
+    if request.method != 'POST':
+        return request.method
+    
+    for mechanism in getattr(settings, 'REROUTE_METHOD_OVERRIDE', DEFAULT_METHOD_OVERRIDE):
+        try:
+            find_method = METHOD_OVERRIDES[mechanism]
+        except KeyError:
+            raise ImproperlyConfigured('Unknown REROUTE_METHOD_OVERRIDE mechanism %r (choose from %s)' % (mechanism, ', '.join(sorted(METHOD_OVERRIDES))))
+        method = find_method(request)
+        if method:
+            return method.upper()
         
-    return method        
+    return request.method
+
+def head_only(request):
+    '''Returns True if request is a HEAD request that a verb_url group dispatched to its GET view
+    (the group has no HEAD view). Such views may skip producing the body, which is discarded:
+    @render doesn't render its template.'''
+    
+    return getattr(request, '_reroute_head_only', False)
+
+# The view and default arguments of one method of a verb_url group
+VerbRecord = namedtuple('VerbRecord', 'callback default_args')
 
 class VerbRegexURLPattern(RerouteRegexURLPattern):
-    patterns_index = {}
+    # Maps each call to reroute_patterns (see PatternsId) to the first pattern of each regex group.
+    # Only needed while the call configures its patterns; the groups themselves live in the
+    # patterns. Only ids that can be weakly referenced group patterns.
+    patterns_index = WeakKeyDictionary()
+    
+    __slots__ = ('method', 'method_callbacks', 'collapsed', '_method_table', '_allow')
     
     def __init__(self, method, *args, **kwargs):
         super(VerbRegexURLPattern, self).__init__(*args, **kwargs)
-        self.method = method.upper() 
+        self.method = intern(str(method.upper()))
+        
+        # True if another pattern of the group resolves this pattern's requests
+        self.collapsed = False
+        
+        self._method_table = None
+        self._allow = None
+    
+    def discard_composed(self):
+        super(VerbRegexURLPattern, self).discard_composed()
+        self._method_table = None
+        self._allow = None
+    
+    @property
+    def method_table(self):
+        '''Maps each HTTP method of the group to its composed callback and default_args.'''
+        
+        table = self._method_table
+        if table is None:
+            table = self._method_table = dict(
+                (method, (self.compose(record.callback), record.default_args))
+                for method, record in self.method_callbacks.iteritems()
+            )
+        return table
+    
+    @property
+    def allow(self):
+        '''The Allow header of the group's OPTIONS and 405 responses.'''
+        
+        allow = self._allow
+        if allow is None:
+            methods = set(self.method_callbacks)
+            methods.add('OPTIONS')
+            if 'GET' in methods:
+                methods.add('HEAD')
+            allow = self._allow = ', '.join(sorted(methods))
+        return allow
     
     def reroute_callback(self, request, *args, **kwargs):
-        record = self.method_callbacks.get(request_method(request))
+        method = request_method(request)
+        table = self.method_table
+        entry = table.get(method)
+        
+        # Unless the group has views for them, HEAD requests go to the GET view, and OPTIONS
+        # requests and other methods are answered without calling a view
+        if not entry:
+            if method == 'HEAD' and 'GET' in table:
+                method = 'GET'
+                entry = table[method]
+                request._reroute_head_only = True
+            else:
+                response = HttpResponse(status=200 if method == 'OPTIONS' else 405)
+                response['Allow'] = self.allow
+                return response
+        
+        callback, default_args = entry
+        if default_args:
+            kwargs.update(default_args)
+        
+        if instrumentation.observers:
+            callback = self.method_callbacks[method].callback
+            return instrumentation.timed_call(self, method, callback, self.wrappers, request, *args, **kwargs)
         
-        if not record:
-            return HttpResponse(status=405)
-            
-        callback = record['callback']
-        kwargs.update(record['default_args'])
-           
-        callback = rollup(callback, self.wrappers)
         return callback(request, *args, **kwargs)
     
     def reroute_config(self, wrappers, patterns_id):
         super(VerbRegexURLPattern, self).reroute_config(wrappers, patterns_id)
         
         # Let patterns with identical regexes that are defined within the same call
-        # to reroute_patterns be called a pattern group. Each pattern in a pattern group
-        # has a reference to shared dict (shared by the group) which maps http methods
-        # to pattern callbacks. Only one pattern from a group will ever be resolved (remember
-        # that the patterns all have identical regexes), so this shared dict is used to route
-        # to the correct callback for a given http method. All this hoopla is necessary since
-        # patterns are resolved outside the context of a request.
+        # to reroute_patterns be called a pattern group. The first pattern of a group (the only
+        # one that could ever be resolved, since the patterns all have identical regexes) holds
+        # a dict which maps http methods to pattern callbacks, and is used to route to the
+        # correct callback for a given http method. All this hoopla is necessary since patterns
+        # are resolved outside the context of a request. The other patterns of the group are
+        # collapsed: reroute_patterns replaces them with stand-ins that are only used by
+        # reverse(), so paths that miss don't pay a regex search per verb.
         
-        method_callbacks_by_regex = self.patterns_index.setdefault(patterns_id, {})
-        method_callbacks = method_callbacks_by_regex.setdefault(self.regex.pattern, {})
+        # Plain regexes are grouped by their source so configuring doesn't compile them; translated
+        # ones by their translation in the active language
+        source = self._regex if isinstance(self._regex, basestring) else self.regex.pattern
+        try:
+            patterns_by_regex = self.patterns_index.setdefault(patterns_id, {})
+        except TypeError:
+            # Ids that can't be weakly referenced (like object()) can't be kept in the index, so
+            # the pattern is configured on its own
+            patterns_by_regex = {}
+        group = patterns_by_regex.setdefault(source, self)
         
-        if self.method not in method_callbacks:
-            method_callbacks[self.method] = {'callback': self.callback, 'default_args': self.default_args}
-            self.default_args = {}
+        # A pattern that's configured again (passed to reroute_patterns with the stand-ins of its
+        # former group) brings along the methods of that group, since only it still dispatches
+        # them
+        records = getattr(self, 'method_callbacks', None)
+        if not records:
+            records = {self.method: VerbRecord(self.callback, self.default_args)}
+        self.default_args = NO_ARGS
+        
+        if group is self:
+            self.collapsed = False
+            self.method_callbacks = {}
+        else:
+            self.collapsed = True
+        
+        method_callbacks = group.method_callbacks
+        for method, record in records.items():
+            if method in method_callbacks:
+                continue
+            method_callbacks[method] = record
+            
+            # Composes the new callback up front (along with the ones registered so far, if the
+            # table hasn't been built yet)
+            group._allow = None
+            table = group._method_table
+            if table is None:
+                group.method_table
+            else:
+                table[method] = (group.compose(record.callback), record.default_args)
         
         # Borg-like
-        self.method_callbacks = method_callbacks       
+        self.method_callbacks = method_callbacks
 
 def verb_url(method, regex, view, kwargs=None, name=None, prefix=''):
     pattern_class = partial(VerbRegexURLPattern, method)
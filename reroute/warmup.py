@@ -0,0 +1,90 @@
+# Copyright (c) 2010 Mark Sandstrom
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''Does the work reroute (and Django) would otherwise do on the first requests: imports the
+urlconfs and views, compiles the regexes and builds the composed wrapper chains, verb method tables
+and pattern group matchers. Call warm_up() before forking worker processes (in wsgi.py with
+gunicorn's --preload, for example) so every worker starts with the warmed state, shared
+copy-on-write, or run the reroute_warmup management command to check a project's urlconf.
+'''
+
+from django.core.exceptions import ImproperlyConfigured, ViewDoesNotExist
+from django.core.urlresolvers import RegexURLResolver, get_resolver
+
+from base import RerouteRegexURLPattern
+
+__all__ = ['warm_up']
+
+def describe(pattern):
+    return '%s %r' % (pattern.__class__.__name__, pattern.regex.pattern)
+
+def warm_pattern(pattern):
+    # Compiles the regex and imports the view
+    pattern.regex
+    callback = pattern.callback
+    
+    if isinstance(pattern, RerouteRegexURLPattern):
+        if not pattern._configured:
+            raise ImproperlyConfigured('RerouteRegexURLPattern patterns must be used within reroute.patterns or reroute_patterns')
+        pattern.compose(callback)
+        # Verb patterns compose the callbacks of every method of the group
+        getattr(pattern, 'method_table', None)
+
+def warm_resolver(resolver, problems):
+    resolver.regex
+    try:
+        # Imports the urlconf module
+        url_patterns = resolver.url_patterns
+    except (ImportError, ImproperlyConfigured), e:
+        problems.append((describe(resolver), e))
+        return 0
+    
+    count = 0
+    for pattern in url_patterns:
+        if isinstance(pattern, RegexURLResolver):
+            count += warm_resolver(pattern, problems)
+        else:
+            try:
+                warm_pattern(pattern)
+            except (ImportError, ImproperlyConfigured, ViewDoesNotExist), e:
+                problems.append((describe(pattern), e))
+            count += 1
+    
+    # Pattern groups build their matchers on first use
+    getattr(resolver, 'matcher', None)
+    return count
+
+def warm_up(urlconf=None):
+    '''Warms every pattern of urlconf (the ROOT_URLCONF by default), following includes.
+    
+    Returns:
+        A (count, problems) tuple. count is the number of patterns; problems is a list of
+        (description, exception) tuples for the patterns that are misconfigured or whose views
+        can't be imported.
+    '''
+    
+    resolver = get_resolver(urlconf)
+    problems = []
+    count = warm_resolver(resolver, problems)
+    
+    # Populates the reverse() lookup tables of every resolver
+    if not problems:
+        resolver.reverse_dict
+    return count, problems
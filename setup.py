@@ -14,7 +14,7 @@ setup(
     author_email='mark@deliciouslynerdy.com',
     url='http://github.com/dnerdy/django-reroute',
     keywords=['reroute', 'django', 'http', 'rest', 'route', 'routing', 'dispatch', 'wrapper'],
-    packages=['reroute'],
+    packages=['reroute', 'reroute.management', 'reroute.management.commands'],
     license='MIT',
     classifiers=[
         'Development Status :: 5 - Production/Stable',
@@ -21,13 +21,30 @@
 import os
 os.environ['DJANGO_SETTINGS_MODULE'] = 'settings'
 
+from StringIO import StringIO
+from datetime import datetime
 from functools import partial
+import gc
+import json
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
 import unittest
+import weakref
 
 from django.conf.urls.defaults import patterns as django_patterns
-from django.core.exceptions import ImproperlyConfigured
-from django.core.urlresolvers import resolve, reverse
-from django.http import HttpRequest, HttpResponse
+from django.core.exceptions import ImproperlyConfigured, ViewDoesNotExist
+from django.core.management.base import CommandError
+from django.core.urlresolvers import NoReverseMatch, clear_url_caches, get_resolver, resolve, reverse, set_urlconf
+from django.http import Http404, HttpRequest, HttpResponse, parse_cookie
+from django.middleware.http import ConditionalGetMiddleware
+from django.test.client import BOUNDARY, RequestFactory, encode_multipart
+from django.test.utils import override_settings
+from django.utils.decorators import method_decorator
+from django.views.decorators.vary import vary_on_cookie
 
 try:
     from django.views.decorators.csrf import csrf_exempt  # django >= 1.2
@@ -35,8 +52,22 @@ except ImportError:
     from django.contrib.csrf.middleware import csrf_exempt  # django < 1.2
 
 import reroute
+from reroute import decorators, instrumentation
 from reroute import patterns, url, include, reroute_patterns
-from reroute.verbs import verb_url
+from reroute import routetable
+from reroute.base import ReversePattern
+from reroute.batch import batch_view
+from reroute.caching import ResponseCache
+from reroute.decorators import StreamingHttpResponse, redirect, render
+from reroute.limits import ConcurrencyLimit
+from reroute.management.commands.reroute_replay import Command as ReplayCommand
+from reroute.management.commands.reroute_routetable import Command as RouteTableCommand
+from reroute.management.commands.reroute_warmup import Command as WarmUpCommand
+from reroute.replay import Replay, replay_files
+from reroute.resolvers import IndexedMatcher
+from reroute.utils import COMPILED_REGEXES, SHARED_WRAPPERS
+from reroute.verbs import VerbRegexURLPattern, head_only, request_method, verb_url
+from reroute.warmup import warm_up
 
 class URLConf():
     def __init__(self, urlpatterns):
@@ -179,6 +210,273 @@ class ReroutePatternsTestCase(unittest.TestCase):
         
         self.assertRaises(ImproperlyConfigured, content, '/test', urlconf)
         
+class ComposedCallbackTestCase(unittest.TestCase):
+    def testComposedOnce(self):
+        pattern, = reroute_patterns([wrapper1, wrapper2], '',
+            url('^test$', wrapper_view)
+        )
+        
+        composed = pattern.compose(pattern.callback)
+        self.assertTrue(pattern.compose(pattern.callback) is composed)
+        self.assertEqual(content('/test', URLConf([pattern])), 'wrapper 1 2')
+        self.assertTrue(pattern.compose(pattern.callback) is composed)
+        
+    def testStringViewResolvedLazily(self):
+        pattern, = reroute_patterns([wrapper1], 'tests',
+            url('^test$', 'wrapper_view')
+        )
+        
+        self.assertTrue(pattern._callback is None)
+        self.assertEqual(content('/test', URLConf([pattern])), 'wrapper 1')
+        self.assertEqual(pattern._callback.__name__, 'wrapper_view')
+        
+    def testWrappersChange(self):
+        pattern, = reroute_patterns([wrapper1], '',
+            url('^test$', wrapper_view)
+        )
+        urlconf = URLConf([pattern])
+        
+        self.assertEqual(content('/test', urlconf), 'wrapper 1')
+        pattern.wrappers = [wrapper1, wrapper2]
+        self.assertEqual(content('/test', urlconf), 'wrapper 1 2')
+        pattern.reroute_config([wrapper1], object())
+        self.assertEqual(content('/test', urlconf), 'wrapper 1')
+        
+def args_view(request, *args, **kwargs):
+    return HttpResponse(repr((args, sorted(kwargs.items()))))
+    
+class CompiledMatcherTestCase(unittest.TestCase):
+    def setUp(self):
+        included_urlpatterns = patterns('tests',
+            url('^included_view$', 'generic_view')
+        )
+        
+        self.urlconf = URLConf(reroute_patterns([wrapper1], 'tests',
+            url(r'^first/(?P<key>\w+)$', 'kwarg_view'),
+            url(r'^first/second$', 'view_two'),
+            url(r'^positional/(\d+)/(\d+)$', 'args_view'),
+            url(r'^named/(?P<a>\d+)/(\d+)$', 'args_view', {'extra': 'x'}),
+            url(r'^optional/(?P<a>\d+)?$', 'args_view'),
+            url(r'^backref/(\w)\1$', 'args_view'),
+            url('^class/[(|)]$', 'view_one', name='class_view'),
+            url('^include/', include(included_urlpatterns)),
+            url('unanchored$', 'view_three'),
+            url('^wrapped$', 'wrapper_view'),
+            matcher='compiled'
+        ))
+        
+    def testFirstMatchWins(self):
+        self.assertEqual(content('/first/second', self.urlconf), 'second')
+        
+    def testArguments(self):
+        self.assertEqual(content('/positional/1/2', self.urlconf), repr((('1', '2'), [])))
+        self.assertEqual(content('/named/1/2', self.urlconf), repr(((), [('a', '1'), ('extra', 'x')])))
+        self.assertEqual(content('/optional/', self.urlconf), repr(((), [('a', None)])))
+        
+    def testFallback(self):
+        self.assertEqual(content('/backref/aa', self.urlconf), repr((('a',), [])))
+        self.assertRaises(Http404, content, '/backref/ab', self.urlconf)
+        self.assertEqual(content('/class/|', self.urlconf), 'ONE')
+        self.assertEqual(content('/include/included_view', self.urlconf), 'OK')
+        self.assertEqual(content('/not_anchored/unanchored', self.urlconf), 'THREE')
+        
+    def testWrappers(self):
+        self.assertEqual(content('/wrapped', self.urlconf), 'wrapper 1')
+        
+    def testReverse(self):
+        self.assertEqual(reverse('class_view', self.urlconf), '/class/(')
+        self.assertEqual(reverse('tests.view_two', self.urlconf), '/first/second')
+        
+    def testSegments(self):
+        group, = self.urlconf.urlpatterns
+        self.assertEqual(len(group.matcher.segments), 6)
+        
+    def testNotFound(self):
+        self.assertRaises(Http404, content, '/missing', self.urlconf)
+        
+    def testUnknownMatcher(self):
+        self.assertRaises(ImproperlyConfigured, reroute_patterns, [], '', url('^test$', 'view_one'), matcher='unknown')
+        
+    def testNonAsciiByteStrings(self):
+        urlconf = URLConf(reroute_patterns([], 'tests',
+            url('^caf\xc3\xa9$', 'view_one'),
+            url(u'^t\xe9a$', 'view_two'),
+            url('^plain$', 'view_three'),
+            matcher='compiled'
+        ))
+        self.assertEqual(content(u'/t\xe9a', urlconf), 'TWO')
+        self.assertEqual(content('/plain', urlconf), 'THREE')
+        self.assertEqual(content(u'/caf\xc3\xa9', urlconf), 'ONE')
+        group, = urlconf.urlpatterns
+        self.assertEqual(len(group.matcher.segments), 2)
+
+class IndexedMatcherTestCase(unittest.TestCase):
+    def setUp(self):
+        included_urlpatterns = patterns('tests',
+            url('^included_view$', 'generic_view')
+        )
+        
+        self.urlconf = URLConf(reroute_patterns([wrapper1], 'tests',
+            url(r'^api/v2/orders/(?P<key>\w+)$', 'kwarg_view'),
+            url(r'^api/v2/orders/second$', 'view_two'),
+            url(r'^api/v2/items\.json$', 'view_one'),
+            url(r'^api/v2/itemsx?$', 'view_three'),
+            url('^api/v2/wrapped$', 'wrapper_view'),
+            url('^include/', include(included_urlpatterns)),
+            url('wrapped$', 'view_two'),
+            matcher='indexed'
+        ))
+        
+        group, = self.urlconf.urlpatterns
+        self.matcher = group.matcher
+        
+    def testLiteralPrefixes(self):
+        self.assertEqual(self.matcher.index.prefixes, [
+            'api/v2/orders/', 'api/v2/orders/second', 'api/v2/items.json', 'api/v2/items', 'api/v2/wrapped', 'include/', ''
+        ])
+        
+    def testCandidates(self):
+        self.assertEqual(len(self.matcher.candidates('api/v2/orders/second')), 3)
+        self.assertEqual(len(self.matcher.candidates('api/v2/items')), 2)
+        self.assertEqual(len(self.matcher.candidates('missing')), 1)
+        
+    def testDeclarationOrder(self):
+        self.assertEqual(content('/api/v2/orders/second', self.urlconf), 'second')
+        self.assertEqual(content('/api/v2/items.json', self.urlconf), 'ONE')
+        self.assertEqual(content('/api/v2/itemsx', self.urlconf), 'THREE')
+        self.assertEqual(content('/api/v2/wrapped', self.urlconf), 'wrapper 1')
+        self.assertEqual(content('/other/wrapped', self.urlconf), 'TWO')
+        self.assertEqual(content('/include/included_view', self.urlconf), 'OK')
+        self.assertRaises(Http404, content, '/api/v2/missing', self.urlconf)
+
+class PatternCallbackTestCase(unittest.TestCase):
+    def setUp(self):
+        self.urlconf = URLConf(patterns('tests',
+            url('^csrf_exempt_view$', csrf_exempt_view),
+            url('^kwargs/(?P<key>\w+)$', 'kwarg_view'),
+            url('^defaults$', 'kwarg_view', {'key': 'default'}),
+        ))
+        
+    def testReused(self):
+        first = resolve('/kwargs/a', self.urlconf)
+        second = resolve('/kwargs/b', self.urlconf)
+        self.assertTrue(first.func is second.func)
+        self.assertEqual((first.kwargs, second.kwargs), ({'key': 'a'}, {'key': 'b'}))
+        self.assertEqual(first.func(HttpRequest(), **first.kwargs).content, 'a')
+        
+    def testViewAttributes(self):
+        callback = resolve('/csrf_exempt_view', self.urlconf).func
+        self.assertTrue(callback.csrf_exempt)
+        self.assertEqual(callback.__name__, 'csrf_exempt_view')
+        self.assertEqual(resolve('/kwargs/a', self.urlconf).url_name, 'tests.kwarg_view')
+        self.assertFalse(hasattr(resolve('/defaults', self.urlconf).func, 'csrf_exempt'))
+        
+    def testDefaultArgsNotShared(self):
+        kwargs = resolve('/defaults', self.urlconf).kwargs
+        kwargs['key'] = 'changed'
+        self.assertEqual(resolve('/defaults', self.urlconf).kwargs, {'key': 'default'})
+
+class AdaptiveMatcherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.patterns = reroute_patterns([], 'tests',
+            url(r'^a/x$', 'view_one'),
+            url(r'^b/(?P<key>\d+)$', 'kwarg_view'),
+            url(r'^b/(?P<key>\w+)$', 'kwarg_view', {'key': 'word'}),
+            url(r'^c/(?P<key>\w+)$', 'kwarg_view'),
+            url(r'^(?P<key>\w+)/edit$', 'kwarg_view'),
+            url(r'^d$', 'view_two'),
+        )
+        self.group, = reroute_patterns([], '', *self.patterns, **{'matcher': 'adaptive'})
+        self.matcher = self.group.matcher
+        
+    def regexes(self, patterns):
+        return [pattern.regex.pattern for pattern in patterns]
+        
+    def testReorder(self):
+        for i in range(3):
+            self.group.resolve('c/key')
+            self.group.resolve('b/1')
+        self.group.resolve('c/key')
+        self.group.resolve('d')
+        self.matcher.reorder()
+        
+        # ^b/ patterns keep their order, and nothing moves past the pattern without a prefix
+        self.assertEqual(self.regexes(self.matcher.order), [
+            r'^c/(?P<key>\w+)$', r'^b/(?P<key>\d+)$', r'^a/x$', r'^b/(?P<key>\w+)$',
+            r'^(?P<key>\w+)/edit$', r'^d$',
+        ])
+        self.assertEqual([hits for pattern, hits in self.matcher.counters()], [0, 3, 0, 4, 0, 1])
+        
+    def testSameResults(self):
+        paths = ['a/x', 'b/1', 'b/word', 'c/key', 'c/edit', 'b/edit', 'd', 'd/edit', 'missing']
+        for path in paths * 3:
+            try:
+                self.group.resolve(path)
+            except Http404:
+                pass
+        self.matcher.reorder()
+        
+        sequential = URLConf(self.patterns)
+        adaptive = URLConf([self.group])
+        for path in paths:
+            try:
+                expected = content('/' + path, sequential)
+            except Http404:
+                self.assertRaises(Http404, content, '/' + path, adaptive)
+            else:
+                self.assertEqual(content('/' + path, adaptive), expected)
+        
+    def testPeriodicReorder(self):
+        self.matcher.REORDER_EVERY = 5
+        for i in range(5):
+            self.group.resolve('d')
+        self.assertEqual(self.regexes(self.matcher.order)[-1], r'^d$')
+        self.assertEqual(self.regexes(self.matcher.order)[0], r'^a/x$')
+        
+        self.matcher.REORDER_EVERY = 4
+        for i in range(3):
+            self.group.resolve('c/key')
+        self.assertEqual(self.regexes(self.matcher.order)[0], r'^c/(?P<key>\w+)$')
+
+class ResolveCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.group, = reroute_patterns([], 'tests',
+            url(r'^first/(?P<key>\w+)$', 'kwarg_view'),
+            url(r'^second/(?P<key>\w+)$', 'kwarg_view', {'extra': 'x'}),
+            url(r'^third$', 'view_three'),
+            cache_size=2
+        )
+        self.cache = self.group.cache
+        
+    def testHitsAndMisses(self):
+        self.group.resolve('first/a')
+        self.group.resolve('first/a')
+        self.assertRaises(Http404, self.group.resolve, 'missing')
+        self.assertRaises(Http404, self.group.resolve, 'missing')
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 2))
+        
+    def testEviction(self):
+        self.group.resolve('first/a')
+        self.group.resolve('second/b')
+        self.group.resolve('first/a')
+        self.group.resolve('third')
+        self.assertEqual(len(self.cache), 2)
+        self.group.resolve('first/a')
+        self.group.resolve('second/b')
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 4))
+        
+    def testFreshKwargs(self):
+        callback, args, kwargs = self.group.resolve('second/b')
+        kwargs['key'] = 'changed'
+        callback, args, kwargs = self.group.resolve('second/b')
+        self.assertEqual(kwargs, {'key': 'b', 'extra': 'x'})
+        
+    def testReconfigureClears(self):
+        self.group.resolve('first/a')
+        pattern = self.group.url_patterns[0]
+        pattern.reroute_config([wrapper1], object())
+        self.assertEqual(len(self.cache), 0)
+        
 class VerbURLTestCase(unittest.TestCase):
     def setUp(self):
         included_urlpatterns = patterns('tests',
@@ -222,5 +520,1094 @@ class VerbURLTestCase(unittest.TestCase):
         response = request_with_method('PUT', '/include/test', self.urlconf)
         self.assertEqual(response.status_code, 405)
 
+class VerbGroupCollapseTestCase(unittest.TestCase):
+    def setUp(self):
+        self.urlpatterns = reroute_patterns([wrapper1], 'tests',
+            verb_url('GET',     '^test$', 'wrapper_view', name='test_get'),
+            verb_url('POST',    '^test$', 'view_one', name='test_post'),
+            url('^other$', 'view_two'),
+            verb_url('PUT',     '^test$', 'view_two'),
+        )
+        self.urlconf = URLConf(self.urlpatterns)
+        
+    def testCollapsed(self):
+        dispatcher, post, other, put = self.urlpatterns
+        self.assertTrue(isinstance(dispatcher, VerbRegexURLPattern))
+        self.assertTrue(isinstance(post, ReversePattern))
+        self.assertTrue(isinstance(put, ReversePattern))
+        self.assertEqual(sorted(dispatcher.method_table), ['GET', 'POST', 'PUT'])
+        self.assertTrue(post.resolve('test') is None)
+        
+    def testDispatch(self):
+        self.assertEqual(content_with_method('GET', '/test', self.urlconf), 'wrapper 1')
+        self.assertEqual(content_with_method('POST', '/test', self.urlconf), 'ONE')
+        self.assertEqual(content_with_method('PUT', '/test', self.urlconf), 'TWO')
+        self.assertEqual(request_with_method('DELETE', '/test', self.urlconf).status_code, 405)
+        
+    def testReverse(self):
+        self.assertEqual(reverse('test_get', self.urlconf), '/test')
+        self.assertEqual(reverse('test_post', self.urlconf), '/test')
+        self.assertEqual(reverse('tests.view_one', self.urlconf), '/test')
+        
+    def testMatcher(self):
+        urlconf = URLConf(reroute_patterns([], 'tests',
+            verb_url('GET',     '^test/(?P<key>\w+)$', 'kwarg_view'),
+            verb_url('POST',    '^test/(?P<key>\w+)$', 'kwarg_view'),
+            url('^other$', 'view_two'),
+            matcher='compiled'
+        ))
+        group, = urlconf.urlpatterns
+        self.assertEqual(len(group.matcher.segments), 1)
+        self.assertEqual(content_with_method('GET', '/test/a', urlconf), 'a')
+        self.assertEqual(content('/other', urlconf), 'TWO')
+        
+    def testConfiguredAgain(self):
+        inner = reroute_patterns([], 'tests',
+            verb_url('GET',     '^test/(?P<key>\w+)$', 'kwarg_view'),
+            verb_url('POST',    '^test/(?P<key>\w+)$', 'kwarg_view', {'key': 'posted'}),
+        )
+        outer = URLConf(patterns('', *inner))
+        grouped = URLConf(reroute_patterns([wrapper1], '', *inner, **{'matcher': 'adaptive'}))
+        for urlconf in (outer, grouped, URLConf(inner)):
+            self.assertEqual(content_with_method('GET', '/test/a', urlconf), 'a')
+            self.assertEqual(content_with_method('POST', '/test/a', urlconf), 'posted')
+            self.assertEqual(request_with_method('PUT', '/test/a', urlconf)['Allow'], 'GET, HEAD, OPTIONS, POST')
+            
+    def testPlainPatternsId(self):
+        pattern = VerbRegexURLPattern('PUT', '^test$', 'tests.method_view')
+        pattern.reroute_config([wrapper1], object())
+        urlconf = URLConf([pattern])
+        self.assertEqual(content_with_method('PUT', '/test', urlconf), 'PUT')
+        self.assertEqual(request_with_method('GET', '/test', urlconf).status_code, 405)
+
+def head_view(request):
+    return HttpResponse('head_only=%s' % head_only(request))
+
+class VerbAutomaticMethodsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.urlconf = URLConf(reroute_patterns([], 'tests',
+            verb_url('GET',     '^test$', 'head_view'),
+            verb_url('POST',    '^test$', 'method_view'),
+            verb_url('PUT',     '^post$', 'method_view'),
+            verb_url('GET',     '^explicit$', 'head_view'),
+            verb_url('HEAD',    '^explicit$', 'method_view'),
+            verb_url('OPTIONS', '^explicit$', 'method_view'),
+        ))
+        
+    def testMethodNotAllowed(self):
+        response = request_with_method('DELETE', '/test', self.urlconf)
+        self.assertEqual(response.status_code, 405)
+        self.assertEqual(response['Allow'], 'GET, HEAD, OPTIONS, POST')
+        self.assertEqual(request_with_method('GET', '/post', self.urlconf)['Allow'], 'OPTIONS, PUT')
+        
+    def testOptions(self):
+        response = request_with_method('OPTIONS', '/test', self.urlconf)
+        self.assertEqual((response.status_code, response.content), (200, ''))
+        self.assertEqual(response['Allow'], 'GET, HEAD, OPTIONS, POST')
+        self.assertEqual(content_with_method('OPTIONS', '/explicit', self.urlconf), 'OPTIONS')
+        
+    def testHead(self):
+        self.assertEqual(content_with_method('HEAD', '/test', self.urlconf), 'head_only=True')
+        self.assertEqual(content_with_method('GET', '/test', self.urlconf), 'head_only=False')
+        self.assertEqual(content_with_method('HEAD', '/explicit', self.urlconf), 'HEAD')
+        self.assertEqual(request_with_method('HEAD', '/post', self.urlconf).status_code, 405)
+
+class PatternsIndexTestCase(unittest.TestCase):
+    def build(self):
+        return URLConf(patterns('tests',
+            verb_url('GET',     '^test$', 'method_view'),
+            verb_url('POST',    '^test$', 'method_view'),
+        ))
+        
+    def live_patterns(self):
+        # Django's resolver cache holds on to every urlconf that has been resolved against, and the
+        # re module's cache to the last regexes compiled
+        clear_url_caches()
+        re.purge()
+        gc.collect()
+        return sum(1 for obj in gc.get_objects() if isinstance(obj, VerbRegexURLPattern))
+        
+    def testRepeatedBuildsAreFreed(self):
+        urlconf = self.build()
+        self.assertEqual(content_with_method('POST', '/test', urlconf), 'POST')
+        del urlconf
+        
+        before = self.live_patterns()
+        for i in range(100):
+            urlconf = self.build()
+            content_with_method('GET', '/test', urlconf)
+        del urlconf
+        
+        self.assertEqual(self.live_patterns(), before)
+        self.assertEqual(len(VerbRegexURLPattern.patterns_index), 0)
+        
+    def testTenantUrlconfsAreFreed(self):
+        # Every tenant's urlconf has its own wrappers and regexes
+        def build(tenant):
+            return URLConf(reroute_patterns([ResponseCache()], 'tests',
+                verb_url('GET',     '^tenant%d$' % tenant, 'method_view'),
+                verb_url('POST',    '^tenant%d$' % tenant, 'method_view'),
+            ))
+        
+        self.live_patterns()
+        wrappers, regexes = len(SHARED_WRAPPERS), len(COMPILED_REGEXES)
+        caches = []
+        for tenant in range(100):
+            urlconf = build(tenant)
+            self.assertEqual(content_with_method('POST', '/tenant%d' % tenant, urlconf), 'POST')
+            caches.append(weakref.ref(urlconf.urlpatterns[0].wrappers[0]))
+        del urlconf
+        
+        self.live_patterns()
+        self.assertEqual([cache for cache in caches if cache() is not None], [])
+        self.assertEqual(len(SHARED_WRAPPERS), wrappers)
+        self.assertEqual(len(COMPILED_REGEXES), regexes)
+
+class MethodOverrideTestCase(unittest.TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        
+    def testPost(self):
+        request = self.factory.post('/', {'_method': 'put'})
+        self.assertEqual(request_method(request), 'PUT')
+        
+    def testOnlyPost(self):
+        request = self.factory.get('/', HTTP_X_HTTP_METHOD_OVERRIDE='DELETE')
+        with override_settings(REROUTE_METHOD_OVERRIDE=('header',)):
+            self.assertEqual(request_method(request), 'GET')
+            
+    def testHeader(self):
+        request = self.factory.post('/', {'_method': 'put'}, HTTP_X_HTTP_METHOD_OVERRIDE='delete')
+        with override_settings(REROUTE_METHOD_OVERRIDE=('header', 'post')):
+            self.assertEqual(request_method(request), 'DELETE')
+        with override_settings(REROUTE_METHOD_OVERRIDE=('post', 'header')):
+            self.assertEqual(request_method(request), 'PUT')
+            
+    def testUnknownMechanism(self):
+        request = self.factory.post('/', {})
+        with override_settings(REROUTE_METHOD_OVERRIDE=('cookie',)):
+            self.assertRaises(ImproperlyConfigured, request_method, request)
+            
+    def testBodyUrlencoded(self):
+        data = 'name=value&_method=put&other=' + 'x' * 100000
+        request = self.factory.post('/', data, content_type='application/x-www-form-urlencoded')
+        with override_settings(REROUTE_METHOD_OVERRIDE=('body',)):
+            self.assertEqual(request_method(request), 'PUT')
+        self.assertFalse(hasattr(request, '_post'))
+        self.assertEqual(request.POST['name'], 'value')
+        self.assertEqual(len(request.POST['other']), 100000)
+        
+    def testBodyUrlencodedBeyondLimit(self):
+        data = 'other=' + 'x' * 100 + '&_method=put'
+        request = self.factory.post('/', data, content_type='application/x-www-form-urlencoded')
+        with override_settings(REROUTE_METHOD_OVERRIDE=('body',), REROUTE_METHOD_OVERRIDE_SCAN_LIMIT=110):
+            self.assertEqual(request_method(request), 'POST')
+        self.assertEqual(request.body, data)
+        
+    def multipart_request(self, *fields):
+        # encode_multipart doesn't preserve the order of its fields
+        closing = '--%s--\r\n' % BOUNDARY
+        data = ''.join(encode_multipart(BOUNDARY, dict([field]))[:-len(closing)] for field in fields) + closing
+        return self.factory.post('/', data, content_type='multipart/form-data;boundary=%s' % BOUNDARY)
+        
+    def upload(self, size):
+        upload = StringIO('x' * size)
+        upload.name = 'upload.txt'
+        return upload
+        
+    def testBodyMultipart(self):
+        request = self.multipart_request(('name', 'value'), ('_method', 'delete'), ('upload', self.upload(100000)))
+        with override_settings(REROUTE_METHOD_OVERRIDE=('body',)):
+            self.assertEqual(request_method(request), 'DELETE')
+        self.assertEqual(request.POST['name'], 'value')
+        self.assertEqual(len(request.FILES['upload'].read()), 100000)
+        
+    def testBodyMultipartAfterUpload(self):
+        request = self.multipart_request(('upload', self.upload(1000)), ('_method', 'put'))
+        with override_settings(REROUTE_METHOD_OVERRIDE=('body',)):
+            self.assertEqual(request_method(request), 'POST')
+        self.assertEqual(len(request.FILES['upload'].read()), 1000)
+        self.assertEqual(request.POST['_method'], 'put')
+
+class RenderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.template_dir = tempfile.mkdtemp()
+        self.settings = override_settings(TEMPLATE_DIRS=(self.template_dir,), DEBUG=False)
+        self.settings.enable()
+        self.write('page.html', '<h1>{{ title }}</h1>{% for item in items %}<li>{{ item }}</li>{% endfor %}<p>{{ footer }}</p>')
+        
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.template_dir)
+        
+    def write(self, name, source):
+        with open(os.path.join(self.template_dir, name), 'w') as template:
+            template.write(source)
+            
+    def view(self, **options):
+        @render('page.html', footer='end', **options)
+        def page(request):
+            return {'title': 'Title', 'items': [1, 2]}
+        return page
+        
+    def testRender(self):
+        response = self.view()(HttpRequest())
+        self.assertEqual(response.content, '<h1>Title</h1><li>1</li><li>2</li><p>end</p>')
+        
+    def testTemplateCached(self):
+        page = self.view()
+        page(HttpRequest())
+        self.write('page.html', 'changed')
+        self.assertEqual(page(HttpRequest()).content, '<h1>Title</h1><li>1</li><li>2</li><p>end</p>')
+        with override_settings(DEBUG=True):
+            self.assertEqual(page(HttpRequest()).content, 'changed')
+            
+    def testStream(self):
+        response = self.view(stream=True)(HttpRequest())
+        if StreamingHttpResponse is None:
+            # Django < 1.5: middleware that reads the content mustn't empty the body
+            response = ConditionalGetMiddleware().process_response(HttpRequest(), response)
+            self.assertEqual(response.content, '<h1>Title</h1><li>1</li><li>2</li><p>end</p>')
+            self.assertEqual(response['Content-Length'], str(len(response.content)))
+        else:
+            chunks = list(response)
+            self.assertTrue(len(chunks) > 1)
+            self.assertEqual(''.join(chunks), '<h1>Title</h1><li>1</li><li>2</li><p>end</p>')
+        
+    def testHeadOnly(self):
+        rendered = []
+        
+        @render('page.html')
+        def page(request):
+            # Templates call callables
+            return {'title': lambda: rendered.append(request.method) or 'Title'}
+        
+        urlconf = URLConf(reroute_patterns([], '',
+            verb_url('GET', '^page$', page),
+        ))
+        response = request_with_method('HEAD', '/page', urlconf)
+        self.assertEqual((response.status_code, response.content), (200, ''))
+        self.assertEqual(response['Content-Type'], 'text/html; charset=utf-8')
+        self.assertEqual(rendered, [])
+        
+        # Middleware can't advertise the length of the unrendered body
+        response = ConditionalGetMiddleware().process_response(HttpRequest(), response)
+        self.assertFalse(response.has_header('Content-Length'))
+        
+        request_with_method('GET', '/page', urlconf)
+        with override_settings(USE_ETAGS=True):
+            request_with_method('HEAD', '/page', urlconf)
+        self.assertEqual(rendered, ['GET', 'HEAD'])
+        
+    def testConflictingContexts(self):
+        @render('page.html', title='Other', stream=True)
+        def page(request):
+            return {'title': 'Title'}
+        self.assertRaises(ValueError, page, HttpRequest())
+        
+    def conditional_view(self):
+        @render('page.html', footer='end',
+            etag=lambda request, context: 'v%d' % len(context['items']),
+            last_modified=lambda request, context: datetime(2011, 1, 1)
+        )
+        def page(request):
+            return {'title': 'Title', 'items': [1, 2]}
+        return page
+        
+    def conditional_request(self, method='GET', **headers):
+        request = HttpRequest()
+        request.method = method
+        request.META.update(headers)
+        return request
+        
+    def testConditionalHeaders(self):
+        response = self.conditional_view()(self.conditional_request())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], '"v2"')
+        self.assertEqual(response['Last-Modified'], 'Sat, 01 Jan 2011 00:00:00 GMT')
+        
+    def testNotModified(self):
+        page = self.conditional_view()
+        os.remove(os.path.join(self.template_dir, 'page.html'))
+        
+        response = page(self.conditional_request(HTTP_IF_NONE_MATCH='"v2"'))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], '"v2"')
+        response = page(self.conditional_request(HTTP_IF_MODIFIED_SINCE='Sat, 01 Jan 2011 00:00:00 GMT'))
+        self.assertEqual(response.status_code, 304)
+        
+    def testModified(self):
+        page = self.conditional_view()
+        for request in (
+            self.conditional_request(HTTP_IF_NONE_MATCH='"v1"'),
+            self.conditional_request(HTTP_IF_MODIFIED_SINCE='Fri, 31 Dec 2010 00:00:00 GMT'),
+            self.conditional_request('POST', HTTP_IF_NONE_MATCH='"v2"'),
+        ):
+            self.assertEqual(page(request).status_code, 200)
+        
+    def testResponse(self):
+        @render('page.html')
+        def page(request):
+            return HttpResponse('OK')
+        self.assertEqual(page(HttpRequest()).content, 'OK')
+
+class RedirectTestCase(unittest.TestCase):
+    def setUp(self):
+        self.urlconf = URLConf(patterns('tests',
+            url(r'^items/(?P<key>\w+)/edit$', 'kwarg_view', name='item'),
+            url(r'^items/(?P<key>\d+)$', 'kwarg_view', name='item'),
+            url(r'^default$', 'kwarg_view', {'key': 'default'}, name='default'),
+        ))
+        set_urlconf(self.urlconf)
+        
+        @redirect('item')
+        def view(request, **kwargs):
+            return kwargs
+        self.view = view
+        
+    def tearDown(self):
+        set_urlconf(None)
+        
+    def location(self, view, **kwargs):
+        return view(HttpRequest(), **kwargs)['Location']
+        
+    def testRedirect(self):
+        for key in (42, 'abc', u'\xe9'):
+            self.assertEqual(self.location(self.view, key=key), reverse('item', kwargs={'key': key}))
+        self.assertEqual(self.location(self.view, key='abc'), '/items/abc/edit')
+        
+    def testValidation(self):
+        self.assertRaises(NoReverseMatch, self.view, HttpRequest(), key='a-b')
+        self.assertRaises(NoReverseMatch, self.view, HttpRequest(), other=1)
+        
+        @redirect('default')
+        def view(request, **kwargs):
+            return kwargs
+        self.assertEqual(self.location(view), '/default')
+        self.assertEqual(self.location(view, key='default'), '/default')
+        self.assertRaises(NoReverseMatch, view, HttpRequest(), key='other')
+        
+    def testUrlconfChanged(self):
+        self.assertEqual(self.location(self.view, key=42), '/items/42')
+        self.urlconf.urlpatterns = patterns('tests',
+            url(r'^things/(?P<key>\d+)$', 'kwarg_view', name='item'),
+        )
+        clear_url_caches()
+        self.assertEqual(self.location(self.view, key=42), '/things/42')
+        
+    def testDiscardedUrlconfsAreFreed(self):
+        # Per-tenant urlconfs that are built and thrown away
+        resolvers = []
+        for i in range(10):
+            urlconf = URLConf(patterns('tests', url(r'^tenant%d/(?P<key>\d+)$' % i, 'kwarg_view', name='item')))
+            set_urlconf(urlconf)
+            self.assertEqual(self.location(self.view, key=42), '/tenant%d/42' % i)
+            resolvers.append(weakref.ref(get_resolver(urlconf)))
+        set_urlconf(None)
+        del urlconf
+        clear_url_caches()
+        gc.collect()
+        self.assertEqual([resolver() for resolver in resolvers], [None] * 10)
+        
+    def testDottedPathOnFreshResolver(self):
+        @redirect('tests.kwarg_view')
+        def view(request, **kwargs):
+            return kwargs
+        
+        calls = []
+        def counting_reverse(*args, **kwargs):
+            calls.append(args)
+            return reverse(*args, **kwargs)
+        
+        clear_url_caches()
+        self.urlconf.urlpatterns = patterns('tests', url(r'^fresh/(?P<key>\d+)$', 'kwarg_view'))
+        resolve('/fresh/1', self.urlconf)
+        decorators.reverse = counting_reverse
+        try:
+            for key in range(3):
+                self.assertEqual(self.location(view, key=key), '/fresh/%d' % key)
+        finally:
+            decorators.reverse = reverse
+        self.assertEqual(calls, [])
+        
+    def testResponse(self):
+        @redirect('item')
+        def view(request):
+            return HttpResponse('OK')
+        self.assertEqual(view(HttpRequest()).content, 'OK')
+
+class InstrumentationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.events = []
+        self.observer = lambda *event: self.events.append(event)
+        instrumentation.register(self.observer)
+        
+    def tearDown(self):
+        instrumentation.unregister(self.observer)
+        
+    def kinds(self):
+        return [(kind, name, method, wrapper) for kind, name, method, elapsed, wrapper in self.events]
+        
+    def testEvents(self):
+        urlconf = URLConf(reroute_patterns([wrapper1, wrapper2], 'tests',
+            url('^other$', 'view_one'),
+            url('^test$', 'wrapper_view', name='test'),
+        ))
+        self.assertEqual(content('/test', urlconf), 'wrapper 1 2')
+        self.assertEqual(self.kinds(), [
+            ('resolve', '^other$', None, None),
+            ('resolve', 'test', None, None),
+            ('view', 'test', 'GET', None),
+            ('wrapper', 'test', 'GET', wrapper2),
+            ('wrapper', 'test', 'GET', wrapper1),
+        ])
+        self.assertTrue(all(elapsed >= 0 for kind, name, method, elapsed, wrapper in self.events))
+        
+    def testVerbMethod(self):
+        urlconf = URLConf(patterns('tests',
+            verb_url('GET',     '^test$', 'method_view'),
+            verb_url('PUT',     '^test$', 'method_view'),
+        ))
+        request = RequestFactory().post('/test', {'_method': 'put'})
+        callback, args, kwargs = resolve('/test', urlconf)
+        self.assertEqual(callback(request, *args, **kwargs).content, 'POST')
+        self.assertEqual(self.kinds()[-1], ('view', '^test$', 'PUT', None))
+        
+    def testOverriddenMethod(self):
+        urlconf = URLConf(reroute_patterns([], 'tests',
+            url('^test$', 'method_view'),
+        ))
+        request = RequestFactory().post('/test', {'_method': 'delete'})
+        callback, args, kwargs = resolve('/test', urlconf)
+        callback(request, *args, **kwargs)
+        self.assertEqual(self.kinds()[-1], ('view', '^test$', 'DELETE', None))
+        
+    def testGroup(self):
+        group, = reroute_patterns([], 'tests',
+            url('^test$', 'view_one'),
+            url('^other$', 'view_two'),
+            matcher='compiled'
+        )
+        group.resolve('test')
+        self.assertEqual(self.kinds(), [('resolve', group.label, None, None)])
+        
+    def testDisabled(self):
+        instrumentation.unregister(self.observer)
+        self.assertEqual(content('/test', URLConf(patterns('tests', url('^test$', 'view_one')))), 'ONE')
+        self.assertEqual(self.events, [])
+        
+    def testAggregator(self):
+        aggregator = instrumentation.Aggregator()
+        for elapsed in range(1, 101):
+            aggregator('view', 'test', 'GET', elapsed / 1000.0)
+        aggregator('wrapper', 'test', 'GET', 0.5, wrapper1)
+        
+        view, wrapper = aggregator.stats()
+        self.assertEqual((view['kind'], view['count'], view['max']), ('view', 100, 0.1))
+        self.assertAlmostEqual(view['p50'], 0.05, delta=0.005)
+        self.assertAlmostEqual(view['p99'], 0.099, delta=0.009)
+        self.assertEqual(wrapper['wrapper'], 'wrapper1')
+        
+        aggregator('wrapper', 'test', 'GET', 0.5, ResponseCache())
+        aggregator('wrapper', 'test', 'GET', 0.5, ConcurrencyLimit(1))
+        self.assertEqual([entry['wrapper'] for entry in aggregator.stats()], [None, 'ConcurrencyLimit', 'ResponseCache', 'wrapper1'])
+        
+        response = instrumentation.stats_view(aggregator)(HttpRequest())
+        self.assertEqual(json.loads(response.content)[0]['count'], 100)
+
+def unconfigured_patterns():
+    return django_patterns('tests',
+        url('^unconfigured$', 'view_one')
+    )
+
+class WarmUpTestCase(unittest.TestCase):
+    def setUp(self):
+        self.group, = reroute_patterns([wrapper1], 'tests',
+            url('^grouped/one$', 'view_one'),
+            url('^grouped/two$', 'view_two'),
+            matcher='indexed'
+        )
+        self.pattern, = reroute_patterns([wrapper1], 'tests',
+            url('^lazy$', 'wrapper_view')
+        )
+        self.urlconf = URLConf([self.group, self.pattern] + patterns('tests',
+            url('^include/', include(patterns('tests', url('^view$', 'view_three')))),
+        ))
+        
+    def testWarmUp(self):
+        self.assertTrue(self.pattern._callback is None)
+        self.assertTrue(self.group._matcher is None)
+        
+        count, problems = warm_up(self.urlconf)
+        self.assertEqual((count, problems), (4, []))
+        self.assertEqual(self.pattern._callback.__name__, 'wrapper_view')
+        self.assertTrue(self.pattern._composed[0] is self.pattern._callback)
+        self.assertTrue(self.group._matcher is not None)
+        self.assertEqual(content('/lazy', self.urlconf), 'wrapper 1')
+        
+    def testProblems(self):
+        self.urlconf.urlpatterns += patterns('tests', url('^missing$', 'missing_view'))
+        self.urlconf.urlpatterns += unconfigured_patterns()
+        
+        count, problems = warm_up(self.urlconf)
+        self.assertEqual(count, 6)
+        self.assertEqual([description for description, error in problems], [
+            "RerouteRegexURLPattern '^missing$'",
+            "RerouteRegexURLPattern '^unconfigured$'",
+        ])
+        self.assertTrue(isinstance(problems[0][1], ViewDoesNotExist))
+        self.assertTrue(isinstance(problems[1][1], ImproperlyConfigured))
+        
+    def testCommand(self):
+        output = StringIO()
+        WarmUpCommand().execute(urlconf=self.urlconf, stdout=output)
+        self.assertEqual(output.getvalue(), 'Warmed up 4 patterns\n')
+        
+        self.urlconf.urlpatterns += unconfigured_patterns()
+        command = WarmUpCommand()
+        command.stdout = command.stderr = StringIO()
+        self.assertRaises(CommandError, command.handle, urlconf=self.urlconf)
+        self.assertTrue("RerouteRegexURLPattern '^unconfigured$'" in command.stderr.getvalue())
+
+ROUTETABLE_URLS = r"""
+from functools import partial
+from reroute import include, patterns, reroute_patterns, url
+from reroute.verbs import verb_url
+from tests import view_three, wrapper1
+
+urlpatterns = reroute_patterns([wrapper1], 'tests',
+    verb_url('GET', '^verbs$', 'wrapper_view', name='verbs'),
+    verb_url('PUT', '^verbs$', 'kwarg_view', {'key': 'put'}),
+    url('^wrapped$', 'wrapper_view', name='wrapped'),
+) + reroute_patterns([], 'tests',
+    url(r'^grouped/(?P<key>\w+)$', 'kwarg_view', name='grouped'),
+    url('^grouped$', view_three),
+    matcher='indexed', cache_size=10
+) + patterns('',
+    url('^included/', include('routetable_included', namespace='included')),
+)
+
+handler404 = 'tests.view_two'
+"""
+
+ROUTETABLE_INCLUDED = """
+from reroute import patterns, url
+
+urlpatterns = patterns('tests',
+    url('^one$', 'view_one', name='one'),
+)
+"""
+
+class RouteTableTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'routes.table')
+        sys.path.insert(0, self.directory)
+        self.write('routetable_urls', ROUTETABLE_URLS)
+        self.write('routetable_included', ROUTETABLE_INCLUDED)
+        
+    def tearDown(self):
+        sys.path.remove(self.directory)
+        shutil.rmtree(self.directory)
+        self.forget()
+        
+    def write(self, module, source):
+        with open(os.path.join(self.directory, module + '.py'), 'w') as output:
+            output.write(source)
+            
+    def forget(self):
+        for module in ('routetable_urls', 'routetable_included', 'routetable_helpers'):
+            sys.modules.pop(module, None)
+    
+    def testLoad(self):
+        routetable.save(self.path, 'routetable_urls')
+        self.forget()
+        
+        table = routetable.load(self.path, 'routetable_urls')
+        self.assertTrue(table.loaded)
+        self.assertFalse('routetable_urls' in sys.modules)
+        self.assertEqual(table.handler404, 'tests.view_two')
+        
+        urlconf = URLConf(table.urlpatterns)
+        self.assertEqual(content('/verbs', urlconf), 'wrapper 1')
+        self.assertEqual(content_with_method('PUT', '/verbs', urlconf), 'put')
+        self.assertEqual(request_with_method('POST', '/verbs', urlconf).status_code, 405)
+        self.assertEqual(content('/wrapped', urlconf), 'wrapper 1')
+        self.assertEqual(content('/grouped/key', urlconf), 'key')
+        self.assertEqual(content('/grouped', urlconf), 'THREE')
+        self.assertEqual(content('/included/one', urlconf), 'ONE')
+        
+        self.assertEqual(reverse('verbs', urlconf), '/verbs')
+        self.assertEqual(reverse('grouped', urlconf, kwargs={'key': 'a'}), '/grouped/a')
+        self.assertEqual(reverse('included:one', urlconf), '/included/one')
+        
+        group = table.urlpatterns[-2]
+        self.assertTrue(isinstance(group.matcher, IndexedMatcher))
+        self.assertEqual(group.cache.max_size, 10)
+        
+    def testFingerprint(self):
+        routetable.save(self.path, 'routetable_urls')
+        self.forget()
+        self.write('routetable_included', ROUTETABLE_INCLUDED + '# Changed\n')
+        
+        table = routetable.load(self.path, 'routetable_urls')
+        self.assertFalse(table.loaded)
+        self.assertTrue(table.urlpatterns is sys.modules['routetable_urls'].urlpatterns)
+        self.assertEqual(table.handler404, 'tests.view_two')
+        self.assertEqual(table.handler500, 'django.views.defaults.server_error')
+        
+    def testHelperModules(self):
+        # Patterns from a helper module, included as a list
+        self.write('routetable_helpers', ROUTETABLE_INCLUDED)
+        self.write('routetable_urls', ROUTETABLE_URLS + "import routetable_helpers\nurlpatterns += patterns('', url('^helpers/', include(routetable_helpers.urlpatterns)))\n")
+        import routetable_urls
+        
+        # Already imported modules are imported again while saving
+        routetable.save(self.path, 'routetable_urls')
+        self.assertTrue(sys.modules['routetable_urls'] is routetable_urls)
+        self.forget()
+        table = routetable.load(self.path, 'routetable_urls')
+        self.assertTrue(table.loaded)
+        self.assertEqual(content('/helpers/one', URLConf(table.urlpatterns)), 'ONE')
+        
+        self.forget()
+        self.write('routetable_helpers', ROUTETABLE_INCLUDED + '# Changed\n')
+        self.assertFalse(routetable.load(self.path, 'routetable_urls').loaded)
+        
+    def testWrapperInstances(self):
+        self.write('routetable_urls', ROUTETABLE_URLS + """
+from reroute.caching import ResponseCache
+from reroute.limits import ConcurrencyLimit
+
+cache = ResponseCache()
+limit = ConcurrencyLimit(5)
+urlpatterns += reroute_patterns([limit, cache], 'tests', url('^cached$', 'view_one'))
+""")
+        routetable.save(self.path, 'routetable_urls')
+        self.forget()
+        
+        table = routetable.load(self.path, 'routetable_urls')
+        self.assertTrue(table.loaded)
+        module = sys.modules['routetable_urls']
+        self.assertEqual(list(table.urlpatterns[-1].wrappers), [module.limit, module.cache])
+        self.assertEqual(content('/cached', URLConf(table.urlpatterns)), 'ONE')
+        
+    def testMissingFile(self):
+        table = routetable.load(self.path, 'routetable_urls')
+        self.assertFalse(table.loaded)
+        self.assertEqual(content('/included/one', URLConf(table.urlpatterns)), 'ONE')
+        
+    def testUnsupported(self):
+        self.write('routetable_urls', ROUTETABLE_URLS + "urlpatterns += reroute_patterns([partial(wrapper1)], '', url('^partial$', view_three))\n")
+        self.assertRaises(ImproperlyConfigured, routetable.save, self.path, 'routetable_urls')
+        self.assertFalse(os.path.exists(self.path))
+        
+    def testCommand(self):
+        output = StringIO()
+        RouteTableCommand().execute('routetable_urls', self.path, stdout=output)
+        self.assertEqual(output.getvalue(), 'Saved the route table of routetable_urls to %s\n' % self.path)
+        self.assertTrue(routetable.load(self.path, 'routetable_urls').loaded)
+        
+        self.assertRaises(CommandError, RouteTableCommand().handle, 'routetable_urls')
+
+class ResponseCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.urlconf = self.cached_urlconf(ResponseCache(vary=['Accept-Language']))
+        
+    def cached_urlconf(self, cache):
+        self.cache = cache
+        return URLConf(reroute_patterns([cache], '',
+            url(r'^items/(?P<key>\w+)$', self.view),
+            url('^cookie$', self.cookie_view),
+            url('^greeting$', self.greeting_view),
+            url('^slow$', self.slow_view),
+        ))
+        
+    def view(self, request, key):
+        self.calls.append(key)
+        response = HttpResponse('%s %d' % (key, len(self.calls)))
+        response['X-Key'] = key
+        return response
+        
+    def cookie_view(self, request):
+        self.calls.append('cookie')
+        response = HttpResponse('cookie')
+        response.set_cookie('name', 'value')
+        return response
+        
+    @method_decorator(vary_on_cookie)
+    def greeting_view(self, request):
+        self.calls.append('greeting')
+        return HttpResponse('hello %s' % parse_cookie(request.META.get('HTTP_COOKIE', '')).get('name'))
+        
+    def slow_view(self, request):
+        self.calls.append('slow')
+        self.started.set()
+        self.release.wait(5)
+        return HttpResponse('slow %d' % len(self.calls))
+        
+    def request(self, path, method='GET', **meta):
+        request = HttpRequest()
+        request.method = method
+        request.path = request.path_info = path
+        request.META.update(meta)
+        callback, args, kwargs = resolve(path, self.urlconf)
+        return callback(request, *args, **kwargs)
+        
+    def testCache(self):
+        first = self.request('/items/a')
+        second = self.request('/items/a')
+        self.assertEqual((first.content, second.content), ('a 1', 'a 1'))
+        self.assertEqual(second['X-Key'], 'a')
+        self.assertFalse(first is second)
+        self.assertEqual(self.request('/items/b').content, 'b 2')
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 2, 'stale_hits': 0})
+        
+    def testKey(self):
+        self.request('/items/a')
+        self.request('/items/a', QUERY_STRING='page=2')
+        self.request('/items/a', HTTP_ACCEPT_LANGUAGE='fr')
+        self.request('/items/a', 'HEAD')
+        self.assertEqual(self.calls, ['a'] * 4)
+        self.request('/items/a', HTTP_ACCEPT_LANGUAGE='fr')
+        self.assertEqual(len(self.calls), 4)
+        
+    def testUnsafeMethods(self):
+        for method in ('POST', 'PUT', 'DELETE'):
+            self.request('/items/a', method)
+            self.request('/items/a', method)
+        self.assertEqual(len(self.calls), 6)
+        self.assertEqual(self.cache.stats()['misses'], 0)
+        
+    def testUncacheable(self):
+        self.request('/cookie')
+        self.request('/cookie')
+        self.assertEqual(self.calls, ['cookie', 'cookie'])
+        
+    def testHeadOnly(self):
+        # @render answers HEAD requests for a verb_url group's GET view without rendering
+        @render('page.html')
+        def page(request):
+            self.calls.append('page')
+            return {}
+        self.urlconf = URLConf(reroute_patterns([self.cache], '',
+            verb_url('GET', '^page$', page),
+        ))
+        
+        for i in range(2):
+            response = ConditionalGetMiddleware().process_response(HttpRequest(), self.request('/page', 'HEAD'))
+            self.assertFalse(response.has_header('Content-Length'))
+        self.assertEqual(self.calls, ['page', 'page'])
+        
+    def testVaryHeader(self):
+        self.assertEqual(self.request('/greeting', HTTP_COOKIE='name=alice').content, 'hello alice')
+        self.assertEqual(self.request('/greeting', HTTP_COOKIE='name=bob').content, 'hello bob')
+        
+        # Headers listed in vary are part of the key
+        self.urlconf = self.cached_urlconf(ResponseCache(vary=['Cookie']))
+        del self.calls[:]
+        for name in ('alice', 'bob', 'alice'):
+            self.assertEqual(self.request('/greeting', HTTP_COOKIE='name=%s' % name).content, 'hello %s' % name)
+        self.assertEqual(self.calls, ['greeting', 'greeting'])
+        
+    def testExpiry(self):
+        self.urlconf = self.cached_urlconf(ResponseCache(timeout=0, stale=0))
+        self.request('/items/a')
+        self.assertEqual(self.request('/items/a').content, 'a 2')
+        
+    def testDjangoCache(self):
+        from django.core.cache import get_cache
+        backend = get_cache('django.core.cache.backends.locmem.LocMemCache')
+        self.urlconf = self.cached_urlconf(ResponseCache(cache=backend))
+        self.request('/items/a')
+        self.assertEqual(self.request('/items/a').content, 'a 1')
+        self.assertEqual(len(self.calls), 1)
+        
+    def concurrently(self, count):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        responses = []
+        threads = [threading.Thread(target=lambda: responses.append(self.request('/slow').content)) for i in range(count)]
+        threads[0].start()
+        self.started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        return threads, responses
+        
+    def testStampede(self):
+        threads, responses = self.concurrently(5)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.calls, ['slow'])
+        self.assertEqual(responses, ['slow 1'] * 5)
+        
+    def testStale(self):
+        self.urlconf = self.cached_urlconf(ResponseCache(timeout=0, stale=60))
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+        self.request('/slow')
+        
+        threads, responses = self.concurrently(1)
+        self.assertEqual(self.request('/slow').content, 'slow 1')
+        self.release.set()
+        threads[0].join()
+        self.assertEqual(responses, ['slow 2'])
+        self.assertEqual(self.cache.stats()['stale_hits'], 1)
+
+class ConcurrencyLimitTestCase(unittest.TestCase):
+    def setUp(self):
+        self.started = threading.Semaphore(0)
+        self.release = threading.Event()
+        
+    def slow_view(self, request):
+        self.started.release()
+        self.release.wait(5)
+        return HttpResponse(request.method)
+        
+    def urlconf(self, limit):
+        self.limit = limit
+        return URLConf(reroute_patterns([limit], '',
+            url('^slow$', self.slow_view),
+        ))
+        
+    def start(self, urlconf, method='GET'):
+        responses = []
+        thread = threading.Thread(target=lambda: responses.append(request_with_method(method, '/slow', urlconf)))
+        thread.start()
+        return thread, responses
+        
+    def testShed(self):
+        urlconf = self.urlconf(ConcurrencyLimit(1, timeout=0, retry_after=3))
+        thread, responses = self.start(urlconf)
+        self.started.acquire()
+        self.assertEqual(self.limit.stats(), {None: {'in_flight': 1, 'waiting': 0, 'shed': 0}})
+        
+        response = request_with_method('GET', '/slow', urlconf)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '3')
+        
+        self.release.set()
+        thread.join()
+        self.assertEqual(responses[0].content, 'GET')
+        self.assertEqual(self.limit.stats(), {None: {'in_flight': 0, 'waiting': 0, 'shed': 1}})
+        
+    def testQueue(self):
+        urlconf = self.urlconf(ConcurrencyLimit(1, timeout=5))
+        first, first_responses = self.start(urlconf)
+        self.started.acquire()
+        second, second_responses = self.start(urlconf)
+        while not self.limit.stats()[None]['waiting']:
+            time.sleep(0.001)
+        
+        # The queue is full
+        self.assertEqual(request_with_method('GET', '/slow', urlconf).status_code, 503)
+        
+        self.release.set()
+        first.join()
+        second.join()
+        self.assertEqual([first_responses[0].status_code, second_responses[0].status_code], [200, 200])
+        
+    def testByMethod(self):
+        urlconf = self.urlconf(ConcurrencyLimit(1, timeout=0, by='method'))
+        get, get_responses = self.start(urlconf)
+        self.started.acquire()
+        put, put_responses = self.start(urlconf, 'PUT')
+        self.started.acquire()
+        self.release.set()
+        get.join()
+        put.join()
+        self.assertEqual([get_responses[0].content, put_responses[0].content], ['GET', 'PUT'])
+        self.assertEqual(request_with_method('BREW', '/slow', urlconf).content, 'BREW')
+        self.assertEqual(sorted(self.limit.stats()), [None, 'GET', 'PUT'])
+        
+        self.assertRaises(ValueError, ConcurrencyLimit, 1, by='path')
+
+def echo_view(request, key):
+    return HttpResponse('%s %s %s' % (request.method, request.POST.get('name'), request.user))
+
+def failing_view(request):
+    raise RuntimeError('failed')
+
+class BatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.urlconf = URLConf(reroute_patterns([wrapper1], 'tests',
+            verb_url('GET',     r'^items/(?P<key>\w+)$', 'kwarg_view'),
+            verb_url('POST',    r'^items/(?P<key>\w+)$', 'echo_view'),
+            url('^wrapped$', 'wrapper_view'),
+            url('^failing$', 'failing_view'),
+            url('^batch$', batch_view(max_requests=10, max_size=1000)),
+            url('^concurrent$', batch_view(workers=3)),
+        ))
+        
+    def post(self, items, path='/batch'):
+        body = items if isinstance(items, str) else json.dumps(items)
+        request = RequestFactory().post(path, body, content_type='application/json')
+        request.urlconf = self.urlconf
+        request.user = 'someone'
+        callback, args, kwargs = resolve(path, self.urlconf)
+        return callback(request, *args, **kwargs)
+        
+    def results(self, items, path='/batch'):
+        response = self.post(items, path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        return [(result['status'], result['body']) for result in json.loads(response.content)]
+        
+    def testBatch(self):
+        self.assertEqual(self.results([
+            {'method': 'GET', 'path': '/items/a'},
+            {'method': 'POST', 'path': '/items/b', 'body': 'name=Lamp'},
+            {'method': 'DELETE', 'path': '/items/c'},
+            {'path': '/wrapped'},
+            {'path': '/missing'},
+            {'path': '/failing'},
+            {'method': 'POST', 'path': '/batch', 'body': '[]'},
+        ]), [
+            (200, 'a'),
+            (200, 'POST Lamp someone'),
+            (405, ''),
+            (200, 'wrapper 1'),
+            (404, ''),
+            (500, ''),
+            (400, 'Batches can not be nested'),
+        ])
+        
+    def testHeaders(self):
+        response = self.post([{'method': 'POST', 'path': '/items/a?name=query', 'body': '{}', 'headers': {'Content-Type': 'application/json'}}])
+        result, = json.loads(response.content)
+        self.assertEqual(result['body'], 'POST None someone')
+        self.assertEqual(result['headers']['Content-Type'], 'text/html; charset=utf-8')
+        
+    def testConcurrent(self):
+        paths = ['/items/%d' % i for i in range(10)]
+        self.assertEqual(self.results([{'path': path} for path in paths], '/concurrent'),
+            [(200, str(i)) for i in range(10)])
+        
+    def testConnectionsClosed(self):
+        import django.db
+        closed = []
+        close_connection = django.db.close_connection
+        django.db.close_connection = lambda: closed.append(threading.current_thread())
+        try:
+            self.results([{'path': '/items/%d' % i} for i in range(4)], '/concurrent')
+        finally:
+            django.db.close_connection = close_connection
+        self.assertEqual(len(closed), 4)
+        self.assertFalse(threading.current_thread() in closed)
+        
+    def testLimits(self):
+        self.assertEqual(self.post([{'path': '/wrapped'}] * 11).status_code, 413)
+        self.assertEqual(self.post([{'path': '/wrapped', 'body': 'x' * 1000}]).status_code, 413)
+        self.assertEqual(self.post('not json').status_code, 400)
+        self.assertEqual(self.post({'path': '/wrapped'}).status_code, 400)
+        self.assertEqual(self.post([{'path': 'relative'}]).status_code, 400)
+        self.assertEqual(self.post([{'method': 'G E T', 'path': '/wrapped'}]).status_code, 400)
+        
+        request = RequestFactory().get('/batch')
+        response = batch_view()(request)
+        self.assertEqual((response.status_code, response['Allow']), (405, 'POST'))
+
+REPLAY_LOG = """127.0.0.1 - - [17/Oct/2026:10:00:00 +0000] "GET /grouped/a?page=2 HTTP/1.1" 200 3 "-" "Mozilla/5.0"
+127.0.0.1 - - [17/Oct/2026:10:00:01 +0000] "GET /items HTTP/1.1" 200 3
+127.0.0.1 - - [17/Oct/2026:10:00:02 +0000] "POST /items HTTP/1.1" 405 0
+127.0.0.1 - - [17/Oct/2026:10:00:03 +0000] "HEAD http://example.com/items HTTP/1.1" 200 0
+127.0.0.1 - - [17/Oct/2026:10:00:04 +0000] "GET /included/one HTTP/1.1" 200 3
+127.0.0.1 - - [17/Oct/2026:10:00:05 +0000] "GET /missing%20page HTTP/1.1" 404 0
+127.0.0.1 - - [17/Oct/2026:10:00:06 +0000] "-" 400 0
+"""
+
+class CompactPatternTestCase(unittest.TestCase):
+    def build(self):
+        return reroute_patterns([wrapper1], 'tests',
+            verb_url('GET', r'^%s/(?P<key>\w+)$' % 'items', 'kwarg_view'),
+            verb_url('PUT', r'^%s/(?P<key>\w+)$' % 'items', 'kwarg_view', {'key': 'put'}),
+            url('^%s$' % 'one', 'view_one'),
+        )
+    
+    def testShared(self):
+        first, second = self.build(), self.build()
+        self.assertTrue(first[0]._regex is second[0]._regex)
+        self.assertTrue(first[0].regex is second[0].regex)
+        self.assertTrue(first[0].wrappers is second[2].wrappers)
+        self.assertTrue(first[0].default_args is first[2].default_args)
+        self.assertRaises(TypeError, first[2].default_args.update, {'key': 'value'})
+        self.assertEqual(first[0].method_callbacks['PUT'].default_args, {'key': 'put'})
+        self.assertEqual(content_with_method('PUT', '/items/a', URLConf(first)), 'put')
+        
+    def testSlots(self):
+        urlconf = URLConf(self.build())
+        self.assertEqual(content('/items/a', urlconf), 'a')
+        self.assertEqual(content('/one', urlconf), 'ONE')
+        for pattern in urlconf.urlpatterns:
+            self.assertEqual(vars(pattern), {})
+
+class ReplayTestCase(unittest.TestCase):
+    def setUp(self):
+        self.urlconf = URLConf(reroute_patterns([], 'tests',
+            url('^grouped/one$', 'view_one'),
+            url(r'^grouped/(?P<key>\w+)$', 'kwarg_view', name='grouped'),
+            matcher='compiled'
+        ) + reroute_patterns([], 'tests',
+            verb_url('GET', '^items$', 'method_view'),
+        ) + reroute_patterns([], 'tests',
+            verb_url('POST', '^items$', 'method_view'),
+        ) + patterns('',
+            url('^included/', include(patterns('tests', url('^one$', 'view_one')))),
+        ))
+        self.directory = tempfile.mkdtemp()
+        
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        
+    def replay(self):
+        replay = Replay(get_resolver(self.urlconf))
+        replay.replay_log(StringIO(REPLAY_LOG))
+        return replay
+    
+    def stats(self, replay):
+        return dict((replay.labels[key], tuple(stats[:2]) + (stats[3],)) for key, stats in replay.stats.iteritems())
+        
+    def testReplay(self):
+        replay = self.replay()
+        self.assertEqual((replay.requests, replay.unmatched, replay.skipped), (6, 1, 1))
+        self.assertEqual(replay.unmatched_paths, {u'/missing page': 1})
+        
+        # hits, patterns tried and 405s
+        self.assertEqual(self.stats(replay), {
+            '^grouped/(?P<key>\\w+)$ [grouped]': (1, 1, 0),
+            '^items$ (GET)': (3, 6, 1),
+            '^included/ ^one$': (1, 5, 0),
+        })
+        self.assertEqual([(replay.labels[key], replay.labels[earlier]) for key, earlier in replay.shadowed], [('^items$ (POST)', '^items$ (GET)')])
+        
+    def testMerge(self):
+        paths = []
+        for index in range(2):
+            paths.append(os.path.join(self.directory, 'access.log.%d' % index))
+            with open(paths[-1], 'w') as log:
+                log.write(REPLAY_LOG)
+        
+        replay = replay_files(paths, self.urlconf, jobs=2)
+        self.assertEqual((replay.requests, replay.unmatched, replay.skipped), (12, 2, 2))
+        self.assertEqual(replay.unmatched_paths, {u'/missing page': 2})
+        self.assertEqual(self.stats(replay), dict((label, tuple(2 * value for value in values)) for label, values in self.stats(self.replay()).iteritems()))
+        
+    def testCommand(self):
+        path = os.path.join(self.directory, 'access.log')
+        with open(path, 'w') as log:
+            log.write(REPLAY_LOG)
+        
+        output = StringIO()
+        ReplayCommand().execute(path, urlconf=self.urlconf, stdout=output)
+        report = output.getvalue()
+        self.assertTrue(report.startswith('6 requests, 1 unmatched, 1 log lines skipped\n'))
+        self.assertTrue('   3      2.0' in report)
+        self.assertTrue('  ^items$ (POST) (shadowed by ^items$ (GET))\n' in report)
+        self.assertTrue('Patterns no request matched (2):\n  ^grouped/one$\n  ^items$ (POST)\n' in report)
+        self.assertRaises(CommandError, ReplayCommand().handle)
+
 if __name__ == '__main__':
     unittest.main()